@@ -217,6 +217,8 @@ class FilePath():
 PAST_MIDNIGHT_HOURS = 5 # how many hours past midnight is still considered the same day
 LOCAL_TZ = pytz.timezone(globals.TIMEZONE)
 class TimeSpan:
+	__slots__ = ("start", "end") # there can be a lot of these, one for each DataItem
+
 	def __init__(self, start: datetime, end: datetime):
 		self.start = start.astimezone(LOCAL_TZ)
 		self.end = end.astimezone(LOCAL_TZ)
@@ -1,65 +1,51 @@
-import datetime
+import contextlib
 import uuid
+import mmap
 from io import BytesIO
 import orjson
 import os
 import typing
 import re
-import shutil
 import json
 
 from .utils import RESOURCE_PATH
+from .cache_index import CacheIndex, CacheItem, get_timestamp, CACHE_INDEX_ENGINES
+from .cache_blobs import BlobStore, hash_bytes, hash_file, remove_file, remove_tree, CACHE_BLOB_DIRNAME
+from .cache_codecs import get_codec, choose_codec
+from .cache_memoize import CacheMemoizer
+from .cache_janitor import CacheJanitor, CACHE_JANITOR_INTERVAL
 
 # TODO: should make the uuid ones go in a specific folder
 
-# TODO: since we can call kewi from multiple places, we should make this cache be robust enough to work with multiple processes working on it at once
-
 # currently set to 1 week timeout for cache files
 CACHE_FILE_TIMEOUT_MS = 1000 * 60 * 60 * 24 * 7
 
-def get_timestamp(date=None):
-	if date is None:
-		date = datetime.datetime.now()
-	return int(datetime.datetime.timestamp(date) * 1000)
-
-class CacheItem(dict):
-	filename: str
-	timestamp: int
-	permanent: bool
-	def __init__(self, json_data={}): # only to be used internally
-		for key in json_data:
-			self[key] = json_data[key]
-		
-	@classmethod
-	def create(cls, filename, permanent=False):
-		item = CacheItem()
-		item["permanent"] = permanent
-		item["filename"] = filename
-		item.update_timestamp()
-		return item
-	
-	@property
-	def permanent(self):
-		return self.get("permanent")
-		
-	@property
-	def filename(self):
-		return self["filename"]
+# once the cache gets bigger than this, the least recently used files get evicted
+CACHE_MAX_BYTES = 1024 * 1024 * 1024 * 20
+# how many items get measured/evicted at a time, and how many new() calls happen between evictions
+CACHE_EVICT_BATCH = 50
 
-	@property
-	def timestamp(self):
-		return self["timestamp"]
+# returns a read-only memoryview of the whole file, backed by a memory map so nothing is read until its used.
+# (on windows the file cant be deleted until the memoryview is released and garbage collected)
+def map_file(filename) -> memoryview:
+	with open(filename, "rb") as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return memoryview(b"") # cant map an empty file
+		mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	return memoryview(mapped)
 
-	def update_timestamp(self):
-		self["timestamp"] = get_timestamp()
-	
-	def is_expired(self, timestamp_threshold):
-		return (not self.permanent) and (self.timestamp < timestamp_threshold)
+def _loads_json(data):
+	try:
+		return orjson.loads(data)
+	except orjson.JSONDecodeError:
+		return json.loads(bytes(data)) # stuff orjson is stricter about, like NaN
 
 # A cached json file that can be easily saved
 class CachedJson:
-	def __init__(self, filepath): # only to be used internally
+	def __init__(self, filepath, cache: 'Cache' = None, uri: str = None): # only to be used internally
 		self.filepath = filepath
+		self.cache = cache
+		self.uri = uri
 		self.data = {}
 		self.read()
 	
@@ -67,17 +53,26 @@ class CachedJson:
 		return os.path.exists(self.filepath)
 
 	def read(self):
-		if os.path.exists(self.filepath):
+		if self.cache is not None:
+			data = self.cache.get(self.uri, "json") # the file might be compressed
+			if data is not None:
+				self.data = data
+		elif os.path.exists(self.filepath):
 			with open(self.filepath, "r", encoding="utf-8") as f:
 				self.data = json.loads(f.read())
 	
 	def save(self):
 		text = json.dumps(self.data, indent="\t")
-		with open(self.filepath, "w+", encoding="utf-8") as f:
-			f.write(text)
+		if self.cache is not None:
+			self.filepath = self.cache.put(self.uri, text.encode("utf-8"), "json")
+		else:
+			with open(self.filepath, "w+", encoding="utf-8") as f:
+				f.write(text)
 	
 	def save_and_show(self):
 		self.save()
+		if self.cache is not None:
+			self.filepath = self.cache.get_filename(self.uri) # decompressed, so it can be opened
 		os.startfile(self.filepath)
 		
 	# Allow access using []
@@ -96,119 +91,420 @@ class CachedJson:
 class Cache:
 	"""
 	A cache for storing files locally on the file system
+
+	Which file each uri maps to is kept track of by the index, which can be stored a few different ways (see cache_index.py).
+	Multiple processes (cli, web backend, discord bot) can share the same cache
+
+	The size of each file is recorded in the index whenever its looked at, and once the total goes over max_bytes the
+	least recently used non-permanent files get evicted, a batch at a time. Long-running processes should call
+	start_janitor(), which expires and evicts files in the background a little at a time
+
+	In content_addressed mode, files are stored once per distinct content in a blob store (see cache_blobs.py), and each
+	uri's file is a reflink/hardlink to its blob. A file gets added to the blob store the next time get_filename() sees it,
+	or right away when written with put(). Filenames returned by get_filename() should be treated as read-only, and new()
+	should be called to get a copy that can be written to
+
+	Data written with put() gets compressed if its big enough (see cache_codecs.py), and get() decompresses it. The file
+	on disk has the codec's suffix on the end, and get_filename() and new() decompress it in place, since their callers
+	expect to be able to use the file directly
 	"""
-	cache_data: typing.Dict[str, CacheItem]
-	def __init__(self):
-		self.cache_dir = RESOURCE_PATH("private/cache/")
+	index: CacheIndex
+	def __init__(self, cache_dir=None, engine="sqlite", max_bytes=CACHE_MAX_BYTES, content_addressed=False):
+		self.engine = engine
+		if cache_dir is None:
+			cache_dir = RESOURCE_PATH("private/cache/")
+		self.cache_dir = cache_dir
 		if not os.path.exists(self.cache_dir):
 			os.makedirs(self.cache_dir)
-		self.cache_data = {}
-		self.cache_index_filename = os.path.join(self.cache_dir, "_cache_index.json")
-		if os.path.exists(self.cache_index_filename):
-			with open(self.cache_index_filename, "rb") as f:
-				json_dict = orjson.loads(f.read())
-				for uri, item in json_dict.items():
-					self.cache_data[uri] = CacheItem(item)
-	
-	def _save_to_disk(self):
-		with open(self.cache_index_filename, "wb+") as f:
-			f.write(orjson.dumps(self.cache_data))
+		self.index = CACHE_INDEX_ENGINES[engine](self.cache_dir)
+		self.max_bytes = max_bytes
+		self.content_addressed = content_addressed
+		self.blobs = BlobStore(os.path.join(self.cache_dir, CACHE_BLOB_DIRNAME))
+		self._new_count = 0
+		self._batch_files: typing.Optional[typing.List[str]] = None # files made by new() during the current batch()
+		self._batch_dirs: typing.Optional[typing.Set[str]] = None # dirs known to exist during the current batch()
+		self.janitor: typing.Optional[CacheJanitor] = None
+		# stats for this process
+		self.hit_count = 0
+		self.miss_count = 0
+		self.evicted_count = 0
+		self.expired_count = 0
 	
 	@property
 	def size(self):
-		return len(self.cache_data)
+		return len(self.index)
 	
 	# Cleans up any old files and flushes the cache to disk
 	def cleanup_and_flush(self):
+		self.expire()
+		while self.evict() > 0:
+			pass
+		self.index.flush()
+
+	# removes files that havent been used in CACHE_FILE_TIMEOUT_MS, the oldest max_items of them (or all of them if None).
+	# returns how many were removed
+	def expire(self, max_items=None):
 		threshold = get_timestamp() - CACHE_FILE_TIMEOUT_MS
-		removed_count = 0
-		for uri, item in list(self.cache_data.items()):
-			if item.is_expired(threshold):
+		expired = self.index.pop_expired(threshold, max_items)
+		for uri, item in expired:
+			self._delete_file(item)
+		self.expired_count += len(expired)
+		return len(expired)
+
+	# starts a background thread that expires and evicts files a little at a time. see CacheJanitor
+	def start_janitor(self, interval=CACHE_JANITOR_INTERVAL) -> CacheJanitor:
+		if self.janitor is None:
+			self.janitor = CacheJanitor(self, interval)
+		self.janitor.start()
+		return self.janitor
+
+	# stats about the cache, for the /kewi/cache endpoint. the counts are for this process only.
+	# bytes_by_prefix is grouped by the first part of the uri, with only the biggest prefix_limit of them listed
+	def stats(self, prefix_limit=20) -> dict:
+		lookups = self.hit_count + self.miss_count
+		prefixes = sorted(self.index.size_by_prefix().items(), key=lambda pair: pair[1][1], reverse=True)
+		return {
+			"engine": self.engine,
+			"entries": len(self.index),
+			"total_bytes": self.index.total_size(),
+			"max_bytes": self.max_bytes,
+			"hits": self.hit_count,
+			"misses": self.miss_count,
+			"hit_rate": (self.hit_count / lookups) if lookups else None,
+			"evicted": self.evicted_count,
+			"expired": self.expired_count,
+			"index_load_ms": (self.index.load_time * 1000) if self.index.load_time is not None else None,
+			"bytes_by_prefix": { prefix: { "count": count, "bytes": size } for prefix, (count, size) in prefixes[:prefix_limit] },
+			"janitor": self.janitor.stats() if self.janitor is not None else None
+		}
+
+	# records the sizes of up to limit items that havent been measured yet
+	def _measure_unsized(self, limit):
+		with self.index.transaction():
+			for uri, item in self.index.get_unsized(limit):
 				filename = os.path.join(self.cache_dir, item.filename)
 				if os.path.isfile(filename):
-					os.remove(filename)
-				removed_count += 1
-				del self.cache_data[uri]
-		self._save_to_disk()
+					self.index.set_size(uri, os.path.getsize(filename))
 
-	def clear(self):
-		if os.path.exists(self.cache_dir):
-			shutil.rmtree(self.cache_dir)
-		if not os.path.exists(self.cache_dir):
-			os.makedirs(self.cache_dir)
+	# evicts up to max_items of the least recently used files if the cache is over max_bytes. returns how many were evicted
+	def evict(self, max_items=CACHE_EVICT_BATCH):
+		if self.max_bytes is None:
+			return 0
+		self._measure_unsized(max_items)
+		if self.index.total_size() <= self.max_bytes:
+			return 0
+		evicted_count = 0
+		with self.index.transaction():
+			while evicted_count < max_items and self.index.total_size() > self.max_bytes:
+				bytes_needed = self.index.total_size() - self.max_bytes
+				items = self.index.pop_least_recently_used(min(CACHE_EVICT_BATCH, max_items - evicted_count), bytes_needed)
+				if len(items) == 0:
+					break # everything left is permanent
+				for uri, item in items:
+					self._delete_file(item)
+				evicted_count += len(items)
+		self.evicted_count += evicted_count
+		return evicted_count
 
-	# Returns the filename of the cached url if it exists, otherwise None
-	def get_filename(self, uri):
-		item = self.cache_data.get(uri)
+	# deletes the file of an item thats been removed from the index, and its blob if nothing else points at it anymore
+	def _delete_file(self, item: CacheItem):
+		filename = os.path.join(self.cache_dir, item.filename)
+		if os.path.isfile(filename):
+			remove_file(filename)
+		self._release_blob(item.blob)
+
+	def _release_blob(self, blob):
+		if blob is not None:
+			with self.index.transaction():
+				if self.index.blob_refcount(blob) == 0:
+					self.blobs.remove(blob)
+
+	def _set_blob(self, uri, item: CacheItem, blob):
+		old_blob = item.blob # the json index updates the item in place
+		with self.index.transaction():
+			self.index.set_blob(uri, blob)
+			if old_blob != blob:
+				self._release_blob(old_blob)
+
+	# adds the uri's file to the blob store, replacing it with a link to the blob. returns the blob
+	def ingest(self, uri):
+		item = self.index.get(uri)
 		if item is None:
 			return None
-		item.update_timestamp()
 		filename = os.path.join(self.cache_dir, item.filename)
 		if not os.path.isfile(filename):
 			return None
+		if item.blob is not None:
+			return item.blob
+		stat_before = os.stat(filename)
+		blob = hash_file(filename) # done outside of the transaction, since it can take a while for big files
+		with self.index.transaction():
+			stat_after = os.stat(filename)
+			if (stat_after.st_size, stat_after.st_mtime_ns) != (stat_before.st_size, stat_before.st_mtime_ns):
+				return None # someone wrote to it while we were hashing it
+			self.blobs.add_file(filename, blob)
+			self._set_blob(uri, item, blob)
+		return blob
+
+	def clear(self):
+		with self.index.transaction():
+			self.index.clear()
+			# everything but the index's own files
+			for name in os.listdir(self.cache_dir):
+				path = os.path.join(self.cache_dir, name)
+				if name in self.index.filenames:
+					continue
+				if os.path.isdir(path) and not os.path.islink(path):
+					remove_tree(path)
+				else:
+					remove_file(path)
+
+	# finds the uri's file, recording that it was used. returns (item, filename), or (None, None) if it doesnt exist
+	def _lookup(self, uri, count_stats=True):
+		item, filename = self._find(uri)
+		if count_stats:
+			if filename is None:
+				self.miss_count += 1
+			else:
+				self.hit_count += 1
+		return item, filename
+
+	def _find(self, uri):
+		item = self.index.get(uri)
+		if item is None:
+			return None, None
+		self.index.touch(uri, get_timestamp())
+		filename = os.path.join(self.cache_dir, item.filename)
+		if item.blob is not None and not os.path.exists(filename) and self.blobs.exists(item.blob):
+			self.blobs.materialize(item.blob, filename)
+		try:
+			size = os.stat(filename).st_size
+		except FileNotFoundError:
+			return None, None
+		if size != item.size:
+			self.index.set_size(uri, size)
+		if self.content_addressed and item.blob is None:
+			self.ingest(uri)
+		return item, filename
+
+	# reads the whole file, decompressing it if its compressed
+	def _read(self, item: CacheItem, filename) -> bytes:
+		with open(filename, "rb") as f:
+			data = f.read()
+		if item.codec is not None:
+			data = get_codec(item.codec).decompress(data)
+		return data
+
+	# replaces the uri's compressed file with a decompressed one. returns the new filename
+	def _decompress(self, uri):
+		with self.index.transaction():
+			item = self.index.get(uri)
+			if item is None:
+				return None
+			filename = os.path.join(self.cache_dir, item.filename)
+			if item.codec is None:
+				return filename
+			data = self._read(item, filename)
+			new_item = CacheItem(item)
+			new_item["filename"] = item.filename[:-len(get_codec(item.codec).suffix)]
+			new_item["codec"] = None
+			new_item["blob"] = None
+			new_item["size"] = len(data)
+			new_filename = os.path.join(self.cache_dir, new_item.filename)
+			with open(new_filename, "wb+") as f:
+				f.write(data)
+			self.index.put(uri, new_item)
+			remove_file(filename)
+			self._release_blob(item.blob)
+		return new_filename
+
+	# Returns the filename of the cached url if it exists, otherwise None
+	def get_filename(self, uri):
+		item, filename = self._lookup(uri)
+		if item is not None and item.codec is not None:
+			filename = self._decompress(uri)
 		return filename
 
+	# Returns the os.stat_result of the cached file if it exists, otherwise None. (for compressed files, this is the compressed file)
+	def stat(self, uri):
+		item, filename = self._lookup(uri, count_stats=False)
+		if filename is None:
+			return None
+		return os.stat(filename)
+
 	# Returns the file if it exists, otherwise None
+	# return_type can be:
+	# - "json": the parsed json
+	# - "text": the file as a string
+	# - "bytes": a BytesIO with the whole file read into it
+	# - "mmap": a read-only memoryview over a memory map of the file, so large files dont get copied into memory
+	# - "stream": a buffered binary file object, which the caller should close
+	# - "filename": the filename
+	# compressed files get decompressed into memory, so "mmap" and "stream" give in-memory buffers for them instead
 	def get(self, uri, return_type):
-		filename = self.get_filename(uri)
+		if return_type == "filename":
+			return self.get_filename(uri)
+		item, filename = self._lookup(uri)
 		if not filename:
 			return None
+		if item.codec is not None:
+			data = self._read(item, filename)
+			if return_type == "json":
+				return _loads_json(data)
+			elif return_type == "text":
+				return data.decode("utf-8")
+			elif return_type == "bytes" or return_type == "stream":
+				return BytesIO(data)
+			elif return_type == "mmap":
+				return memoryview(data)
+			else:
+				raise ValueError(f"Invalid return type '{return_type}'")
 		if return_type == "json":
-			with open(filename, "r") as f:
-				return json.loads(f.read())
+			view = map_file(filename)
+			try:
+				return _loads_json(view)
+			finally:
+				view.release()
 		elif return_type == "text":
 			with open(filename, "r") as f:
 				return f.read()
 		elif return_type == "bytes":
 			with open(filename, "rb") as f:
 				return BytesIO(f.read())
-		elif return_type == "filename":
-			return filename
+		elif return_type == "mmap":
+			return map_file(filename)
+		elif return_type == "stream":
+			return open(filename, "rb")
 		else:
 			raise ValueError(f"Invalid return type '{return_type}'")
 
 	#creates a new entry in the cache and returns the filename of the new entry
 	def new(self, uri, extension=None, permanent=False):
-		item = self.cache_data.get(uri)
-		if item is not None:
-			filename = os.path.join(self.cache_dir, item.filename)
-			if os.path.isfile(filename):
-				return filename
-		
-		dirchars_pattern = "^[a-zA-Z0-9_.-]+$"
-		if re.match(dirchars_pattern, uri):
-			parts = uri.split(".")
-			parts = [item for item in parts if item != ".."]
-			filename = "/".join(parts)
-		else:
-			filename = str(uuid.uuid4())
-		if extension:
-			filename = f"{filename}.{extension}"
-		
-		# make sure the dir exists
-		full_path = os.path.join(self.cache_dir, filename)
-		thedir = os.path.dirname(full_path)
-		if not os.path.exists(thedir):
-			os.makedirs(thedir)
-
-		self.cache_data[uri] = CacheItem.create(filename, permanent=permanent)
-		self._save_to_disk()
+		with self.index.transaction():
+			item = self.index.get(uri)
+			if item is not None:
+				filename = os.path.join(self.cache_dir, item.filename)
+				if item.blob is not None:
+					# the caller is about to write to it, so it needs its own copy
+					self.blobs.detach(item.blob, filename)
+					self._set_blob(uri, item, None)
+				if item.codec is not None and os.path.isfile(filename):
+					filename = self._decompress(uri)
+				if os.path.isfile(filename):
+					return filename
+			
+			dirchars_pattern = "^[a-zA-Z0-9_.-]+$"
+			if re.match(dirchars_pattern, uri):
+				parts = uri.split(".")
+				parts = [item for item in parts if item != ".."]
+				filename = "/".join(parts)
+			else:
+				filename = str(uuid.uuid4())
+			if extension:
+				filename = f"{filename}.{extension}"
+			
+			# make sure the dir exists
+			full_path = os.path.join(self.cache_dir, filename)
+			thedir = os.path.dirname(full_path)
+			if self._batch_dirs is None or thedir not in self._batch_dirs:
+				os.makedirs(thedir, exist_ok=True)
+				if self._batch_dirs is not None:
+					self._batch_dirs.add(thedir)
+
+			self.index.put(uri, CacheItem.create(filename, permanent=permanent))
+			if self._batch_files is not None:
+				self._batch_files.append(full_path)
+
+		self._new_count += 1
+		if self._new_count % CACHE_EVICT_BATCH == 0 and self._batch_files is None:
+			self.evict() # batch() evicts once its done instead
 		return full_path
 
+	# writes the data as the file for the uri, and returns the filename.
+	# codec is "auto" to pick one based on the size of the data, None to not compress it, or the name of one in cache_codecs.py.
+	# in content_addressed mode, data thats already in the blob store doesnt get written again
+	def put(self, uri, data: bytes, extension=None, permanent=False, codec="auto"):
+		if codec == "auto":
+			codec = choose_codec(len(data))
+		if codec is not None:
+			data = get_codec(codec).compress(data)
+		with self.index.transaction():
+			item = self.index.get(uri)
+			if item is not None and item.codec is not None:
+				# no point in decompressing the old one just to overwrite it
+				permanent = permanent or item.permanent
+				self.remove(uri)
+			filename = self.new(uri, extension, permanent)
+			item = self.index.get(uri)
+			if codec is not None:
+				if os.path.exists(filename):
+					remove_file(filename)
+				item = CacheItem(item)
+				item["filename"] += get_codec(codec).suffix
+				item["codec"] = codec
+				self.index.put(uri, item)
+				filename = os.path.join(self.cache_dir, item.filename)
+				if self._batch_files is not None:
+					self._batch_files.append(filename)
+			blob = hash_bytes(data) if self.content_addressed else None
+			if blob is not None and self.blobs.exists(blob):
+				if os.path.exists(filename):
+					remove_file(filename)
+				self.blobs.materialize(blob, filename)
+			else:
+				with open(filename, "wb+") as f:
+					f.write(data)
+				if blob is not None:
+					self.blobs.add_file(filename, blob)
+			self.index.set_size(uri, len(data))
+			if blob is not None:
+				self._set_blob(uri, item, blob)
+		return filename
+
+	# groups everything done to the cache inside it into one transaction, so a loop making lots of entries only writes the
+	# index once at the end. if it raises, the entries made inside it are rolled back and their files deleted (files that
+	# were overwritten stay overwritten). other processes cant write to the cache until it finishes, so keep it short
+	@contextlib.contextmanager
+	def batch(self):
+		with self.index.transaction():
+			if self._batch_files is not None:
+				yield self # already in one
+				return
+			self._batch_files = []
+			self._batch_dirs = set()
+			try:
+				yield self
+			except:
+				for filename in self._batch_files:
+					if os.path.isfile(filename):
+						remove_file(filename)
+				raise
+			finally:
+				self._batch_files = None
+				self._batch_dirs = None
+		self.evict()
+
+	# decorator that saves the return values of the function in the cache. see CacheMemoizer for how the uri is made.
+	# ttl is in seconds, and format is one of "json", "orjson", "pickle", or "bytes"
+	def memoize(self, uri_template, ttl=None, format="json", maxsize=128) -> typing.Callable[[typing.Callable], CacheMemoizer]:
+		def decorator(func):
+			return CacheMemoizer(self, func, uri_template, ttl=ttl, format=format, maxsize=maxsize)
+		return decorator
+
 	def temp(self, extension=None):
 		return self.new(f"temp.tempfile_{extension}", extension)
 	
 	def load_json(self, uri) -> CachedJson:
-		filename = self.new(uri, "json")
-		return CachedJson(filename)
+		item, filename = self._lookup(uri)
+		if filename is None:
+			filename = self.new(uri, "json")
+		return CachedJson(filename, self, uri)
 
 
 	def remove(self, uri):
-		item = self.cache_data.get(uri)
-		if item is not None:
-			filename = os.path.join(self.cache_dir, item.filename)
-			if os.path.isfile(filename):
-				os.remove(filename)
-			del self.cache_data[uri]
+		with self.index.transaction():
+			item = self.index.remove(uri)
+			if item is not None:
+				self._delete_file(item)
 
 
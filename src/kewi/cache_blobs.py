@@ -0,0 +1,131 @@
+import hashlib
+import os
+import shutil
+import stat
+import sys
+
+if os.name != "nt":
+	import fcntl
+
+# a content-addressed store for the cache, where each distinct file content is stored once, named by its hash
+
+CACHE_BLOB_DIRNAME = "_blobs"
+HASH_CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409 # linux ioctl for making a copy-on-write clone of a file (btrfs, xfs)
+
+def hash_bytes(data: bytes) -> str:
+	return hashlib.sha256(data).hexdigest()
+
+def hash_file(filename: str) -> str:
+	sha = hashlib.sha256()
+	with open(filename, "rb") as f:
+		while True:
+			chunk = f.read(HASH_CHUNK_SIZE)
+			if not chunk:
+				break
+			sha.update(chunk)
+	return sha.hexdigest()
+
+# removes a file, even if its read-only
+def remove_file(filename: str):
+	try:
+		os.remove(filename)
+	except PermissionError:
+		if os.name != "nt":
+			raise
+		# windows wont delete read-only files
+		os.chmod(filename, stat.S_IREAD | stat.S_IWRITE)
+		os.remove(filename)
+
+# removes a directory tree, even if it has read-only files in it
+def remove_tree(path: str):
+	def on_error(func, failed_path, exc_info):
+		os.chmod(failed_path, stat.S_IREAD | stat.S_IWRITE)
+		func(failed_path)
+	shutil.rmtree(path, onerror=on_error)
+
+def reflink(source: str, destination: str):
+	if not sys.platform.startswith("linux"):
+		raise OSError("reflinks are only supported on linux")
+	try:
+		with open(source, "rb") as source_file, open(destination, "wb+") as destination_file:
+			fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+	except OSError:
+		if os.path.exists(destination):
+			os.remove(destination)
+		raise
+
+
+class BlobStore:
+	"""
+	Stores blobs at _blobs/<first 2 chars of hash>/<hash>. Blobs are read-only, so that a hardlink to one cant be
+	written to in-place and change the content for every other uri pointing at it
+	"""
+	def __init__(self, root_dir: str):
+		self.root_dir = root_dir
+
+	def path(self, blob: str) -> str:
+		return os.path.join(self.root_dir, blob[:2], blob)
+
+	def exists(self, blob: str) -> bool:
+		return os.path.isfile(self.path(blob))
+
+	def _protect(self, blob: str):
+		os.chmod(self.path(blob), stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+
+	# adds the file to the store, leaving filename as a copy of the blob. returns the blob
+	def add_file(self, filename: str, blob: str = None) -> str:
+		if blob is None:
+			blob = hash_file(filename)
+		if self.exists(blob):
+			# we already have this content, so just point at that instead
+			remove_file(filename)
+			self.materialize(blob, filename)
+			return blob
+		blob_path = self.path(blob)
+		os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+		try:
+			os.link(filename, blob_path)
+		except OSError:
+			shutil.copyfile(filename, blob_path) # filesystem without hardlinks
+		self._protect(blob)
+		return blob
+
+	# makes a file at filename with the blob's content, as cheaply as possible.
+	# a reflink gives a private copy-on-write copy, a hardlink gives a read-only file, and a copy is the fallback
+	def materialize(self, blob: str, filename: str, writable: bool = False):
+		blob_path = self.path(blob)
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		try:
+			reflink(blob_path, filename)
+			os.chmod(filename, stat.S_IREAD | stat.S_IWRITE)
+			return
+		except OSError:
+			pass
+		if not writable:
+			try:
+				os.link(blob_path, filename)
+				return
+			except OSError:
+				pass
+		shutil.copyfile(blob_path, filename)
+		os.chmod(filename, stat.S_IREAD | stat.S_IWRITE)
+
+	# replaces filename (a copy of the blob) with a private copy that can be written to
+	def detach(self, blob: str, filename: str):
+		if os.path.exists(filename):
+			if not (self.exists(blob) and os.path.samefile(filename, self.path(blob))):
+				os.chmod(filename, stat.S_IREAD | stat.S_IWRITE)
+				return # already its own file
+			remove_file(filename)
+			self._protect(blob) # on windows, removing it had to make the shared file writable
+		if self.exists(blob):
+			self.materialize(blob, filename, writable=True)
+
+	def remove(self, blob: str):
+		if self.exists(blob):
+			remove_file(self.path(blob))
+
+	def clear(self):
+		if os.path.exists(self.root_dir):
+			remove_tree(self.root_dir)
@@ -0,0 +1,54 @@
+import gzip
+import typing
+
+# optional, the cache falls back to gzip without them
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+try:
+	import lz4.frame as lz4_frame
+except ImportError:
+	lz4_frame = None
+
+# the compression codecs that files in the cache can be stored with
+
+# files smaller than this arent worth compressing
+CACHE_COMPRESS_MIN_BYTES = 1024 * 4
+# files smaller than this prefer lz4 (fastest to read), bigger ones prefer zstd (smaller on disk, still fast to read)
+CACHE_COMPRESS_ZSTD_MIN_BYTES = 1024 * 256
+
+class CacheCodec:
+	def __init__(self, name: str, suffix: str, compress: typing.Callable[[bytes], bytes], decompress: typing.Callable[[bytes], bytes]):
+		self.name = name
+		self.suffix = suffix # added onto the end of the filename of the compressed file
+		self.compress = compress
+		self.decompress = decompress
+
+CACHE_CODECS: typing.Dict[str, CacheCodec] = {
+	"gzip": CacheCodec("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=6), gzip.decompress)
+}
+if zstandard is not None:
+	CACHE_CODECS["zstd"] = CacheCodec("zstd", ".zst",
+		lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+		lambda data: zstandard.ZstdDecompressor().decompress(data))
+if lz4_frame is not None:
+	CACHE_CODECS["lz4"] = CacheCodec("lz4", ".lz4", lz4_frame.compress, lz4_frame.decompress)
+
+def get_codec(name: str) -> CacheCodec:
+	if name not in CACHE_CODECS:
+		raise ValueError(f"The '{name}' codec isnt available, install the package for it")
+	return CACHE_CODECS[name]
+
+# picks the codec to use for data of the given size, or None if it shouldnt be compressed
+def choose_codec(size: int) -> typing.Optional[str]:
+	if size < CACHE_COMPRESS_MIN_BYTES:
+		return None
+	if size < CACHE_COMPRESS_ZSTD_MIN_BYTES:
+		preferences = ["lz4", "zstd", "gzip"]
+	else:
+		preferences = ["zstd", "lz4", "gzip"]
+	for name in preferences:
+		if name in CACHE_CODECS:
+			return name
+	return None
@@ -0,0 +1,790 @@
+import contextlib
+import datetime
+import heapq
+import itertools
+import orjson
+import os
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from abc import ABC, abstractmethod
+
+from .utils import FileLock
+
+# the different ways the index of the cache can be stored. see CACHE_INDEX_ENGINES at the bottom
+
+CACHE_LOCK_FILENAME = "_cache_index.lock"
+
+CACHE_INDEX_FILENAME = "_cache_index.json"
+CACHE_JOURNAL_FILENAME = "_cache_index.journal"
+# the journal gets compacted into the index snapshot once it has this many records, or once its as long as the index itself
+# (so the cost of rewriting the snapshot is spread out evenly over the entries that were added)
+CACHE_JOURNAL_COMPACT_RECORDS = 5000
+
+CACHE_SQLITE_FILENAME = "_cache_index.sqlite"
+# touches get written to the db in batches of this size, since every get_filename() does one
+CACHE_SQLITE_TOUCH_BATCH = 100
+
+def get_timestamp(date=None):
+	if date is None:
+		date = datetime.datetime.now()
+	return int(datetime.datetime.timestamp(date) * 1000)
+
+class CacheItem(dict):
+	filename: str
+	timestamp: int
+	permanent: bool
+	size: typing.Optional[int] # in bytes, None if it hasnt been measured yet
+	blob: typing.Optional[str] # hash of the content, if its been added to the blob store
+	codec: typing.Optional[str] # the codec the file is compressed with (see cache_codecs.py), or None
+	def __init__(self, json_data={}): # only to be used internally
+		for key in json_data:
+			self[key] = json_data[key]
+
+	@classmethod
+	def create(cls, filename, permanent=False):
+		item = CacheItem()
+		item["permanent"] = permanent
+		item["filename"] = filename
+		item.update_timestamp()
+		return item
+
+	@property
+	def permanent(self):
+		return self.get("permanent")
+
+	@property
+	def filename(self):
+		return self["filename"]
+
+	@property
+	def timestamp(self):
+		return self["timestamp"]
+
+	@property
+	def size(self):
+		return self.get("size")
+
+	@property
+	def blob(self):
+		return self.get("blob")
+
+	@property
+	def codec(self):
+		return self.get("codec")
+
+	def update_timestamp(self):
+		self["timestamp"] = get_timestamp()
+
+	def is_expired(self, timestamp_threshold):
+		return (not self.permanent) and (self.timestamp < timestamp_threshold)
+
+
+class CacheIndex(ABC):
+	"""
+	Keeps track of which uri maps to which CacheItem. Any number of processes can have an index open on the same cache_dir
+	"""
+	def __init__(self, cache_dir: str):
+		self.cache_dir = cache_dir
+		self.load_time: typing.Optional[float] = None # how long loading/opening the index took, in seconds
+
+	@property
+	@abstractmethod
+	def filenames(self) -> typing.List[str]:
+		"""The files in cache_dir that belong to the index itself"""
+		pass
+
+	@abstractmethod
+	def transaction(self) -> typing.ContextManager:
+		"""
+		Groups the reads and writes inside it so no other process can write to the index in the middle of them. They get
+		committed together when the outermost one finishes, or rolled back if it raises
+		"""
+		pass
+
+	@abstractmethod
+	def get(self, uri: str) -> typing.Optional[CacheItem]:
+		pass
+
+	@abstractmethod
+	def put(self, uri: str, item: CacheItem):
+		"""Adds or replaces the item for the uri"""
+		pass
+
+	@abstractmethod
+	def remove(self, uri: str) -> typing.Optional[CacheItem]:
+		"""Removes the uri from the index, returning the item that was removed"""
+		pass
+
+	@abstractmethod
+	def touch(self, uri: str, timestamp: int):
+		"""Updates the last-accessed timestamp of the uri. Allowed to be written out lazily"""
+		pass
+
+	@abstractmethod
+	def set_size(self, uri: str, size: int):
+		"""Records the size in bytes of the uri's file"""
+		pass
+
+	@abstractmethod
+	def get_unsized(self, limit: int) -> typing.List[typing.Tuple[str, CacheItem]]:
+		"""Returns up to limit items whose size hasnt been recorded yet"""
+		pass
+
+	@abstractmethod
+	def set_blob(self, uri: str, blob: typing.Optional[str]):
+		"""Records which blob the uri's file is the content of"""
+		pass
+
+	@abstractmethod
+	def blob_refcount(self, blob: str) -> int:
+		"""How many uris point at the blob"""
+		pass
+
+	@abstractmethod
+	def total_size(self) -> int:
+		"""The total size in bytes of all the items that have a recorded size"""
+		pass
+
+	@abstractmethod
+	def size_by_prefix(self, separator: str = ".") -> typing.Dict[str, typing.Tuple[int, int]]:
+		"""The (count, total recorded size) of the items, grouped by the part of their uri before the first separator"""
+		pass
+
+	@abstractmethod
+	def pop_expired(self, timestamp_threshold: int, limit: typing.Optional[int] = None) -> typing.List[typing.Tuple[str, CacheItem]]:
+		"""Removes the non-permanent items last accessed before the threshold (the oldest limit of them), and returns them"""
+		pass
+
+	@abstractmethod
+	def pop_least_recently_used(self, limit: int, bytes_needed: int) -> typing.List[typing.Tuple[str, CacheItem]]:
+		"""
+		Removes the non-permanent items that were accessed the longest ago, until bytes_needed has been freed or limit items
+		have been removed, and returns them
+		"""
+		pass
+
+	@abstractmethod
+	def flush(self):
+		"""Makes sure everything is written to disk"""
+		pass
+
+	@abstractmethod
+	def clear(self):
+		"""Removes everything from the index"""
+		pass
+
+	@abstractmethod
+	def __len__(self) -> int:
+		pass
+
+
+# An append-only log of changes to the cache index, one orjson record per line
+# the first record is a header with the generation of the journal, which changes every time its compacted. this is how
+# other processes can tell that they need to reload the snapshot instead of just reading the new records
+class CacheJournal:
+	def __init__(self, filename): # only to be used internally
+		self.filename = filename
+		self._file = None
+
+	# reads the complete records in the journal, starting at the given byte offset if its still the given generation.
+	# a partially written last line is ignored.
+	# returns the generation of the journal, the records, and the offset to continue reading from next time
+	def read(self, offset=0, generation=None) -> typing.Tuple[typing.Optional[str], typing.List[dict], int]:
+		if not os.path.exists(self.filename):
+			return None, [], 0
+		with open(self.filename, "rb") as f:
+			header_line = f.readline()
+			journal_generation = None
+			start = 0
+			if header_line.endswith(b"\n"):
+				header = orjson.loads(header_line)
+				if header["op"] == "header":
+					journal_generation = header["generation"]
+					start = len(header_line)
+			if journal_generation == generation:
+				start = max(offset, start)
+			generation = journal_generation
+			f.seek(start)
+			data = f.read()
+		last_newline = data.rfind(b"\n")
+		if last_newline == -1:
+			return generation, [], start
+		records = [orjson.loads(line) for line in data[:last_newline].split(b"\n") if line]
+		return generation, records, start + last_newline + 1
+
+	# appends the records, returning the new length of the journal.
+	# the file is kept open between appends, and gets closed whenever the journal might have been replaced (by reset(), or
+	# by another process clearing or compacting it, which shows up as a new generation), so the next append reopens it
+	def append(self, records: typing.List[dict]) -> int:
+		if self._file is None:
+			self._file = open(self.filename, "ab")
+		self._file.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+		self._file.flush()
+		return os.fstat(self._file.fileno()).st_size
+
+	# empties the journal and starts a new generation, to be done after its been compacted into the snapshot.
+	# returns the new generation
+	def reset(self) -> str:
+		self.close()
+		generation = str(uuid.uuid4())
+		with open(self.filename, "wb+") as f:
+			f.write(orjson.dumps({ "op": "header", "generation": generation }) + b"\n")
+		return generation
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+
+class JsonCacheIndex(CacheIndex):
+	"""
+	The whole index is kept in memory, and stored as a snapshot (_cache_index.json) plus a journal of every
+	new/remove/touch/size/blob since that snapshot was written. The journal gets compacted into the snapshot once it gets long,
+	or on flush()
+
+	Every write happens while holding a lock on _cache_index.lock, after first reading in whatever the other processes
+	have written. The journal records made during a transaction are written out together once it finishes, and if it
+	raises, the in-memory changes are thrown away by reloading from disk
+	"""
+	cache_data: typing.Dict[str, CacheItem]
+	def __init__(self, cache_dir: str):
+		super().__init__(cache_dir)
+		self.cache_data = {}
+		self.cache_index_filename = os.path.join(self.cache_dir, CACHE_INDEX_FILENAME)
+		self.journal = CacheJournal(os.path.join(self.cache_dir, CACHE_JOURNAL_FILENAME))
+		self.journal_generation = None
+		self.journal_offset = 0
+		self.journal_count = 0
+		self.lock = FileLock(os.path.join(self.cache_dir, CACHE_LOCK_FILENAME))
+		# guards the in-memory index between threads (like the janitor's), including for the things that dont need the file lock
+		self._thread_lock = threading.RLock()
+		self._transaction_depth = 0
+		self._touched_uris = set() # touches are written out lazily along with the next journal write
+		self._pending_records: typing.List[dict] = [] # written to the journal when the transaction finishes
+		self._total_size = 0
+		self._unsized_uris = set()
+		self._lru_heap: typing.List[typing.Tuple[int, str]] = [] # (timestamp, uri), with stale entries skipped when popped
+		self._blob_refcounts: typing.Dict[str, int] = {}
+		with self.lock:
+			self._load_from_disk()
+
+	@property
+	def filenames(self):
+		return [ CACHE_INDEX_FILENAME, CACHE_JOURNAL_FILENAME, CACHE_LOCK_FILENAME ]
+
+	@contextlib.contextmanager
+	def transaction(self):
+		with self._thread_lock, self.lock:
+			if self._transaction_depth == 0:
+				self._sync()
+			self._transaction_depth += 1
+			try:
+				yield
+			except:
+				self._transaction_depth -= 1
+				if self._transaction_depth == 0:
+					# roll back to whatever was last written
+					self._pending_records = []
+					self._load_from_disk()
+				raise
+			self._transaction_depth -= 1
+			if self._transaction_depth == 0:
+				self._commit()
+
+	# (re)loads the snapshot and the full journal. should be called while holding the lock
+	def _load_from_disk(self):
+		start = time.perf_counter()
+		self.cache_data = {}
+		self._total_size = 0
+		self._unsized_uris = set()
+		self._lru_heap = []
+		self._blob_refcounts = {}
+		if os.path.exists(self.cache_index_filename):
+			with open(self.cache_index_filename, "rb") as f:
+				json_dict = orjson.loads(f.read())
+				for uri, item in json_dict.items():
+					self._set_item(uri, CacheItem(item))
+		self.journal.close() # the journal might not be the same file we had open anymore
+		self.journal_generation, records, self.journal_offset = self.journal.read()
+		self.journal_count = 0
+		self._apply_records(records)
+		self.load_time = time.perf_counter() - start
+
+	# reads in any changes other processes have made to the index since we last looked. should be called while holding the lock
+	def _sync(self):
+		generation, records, offset = self.journal.read(self.journal_offset, self.journal_generation)
+		if generation != self.journal_generation:
+			# the journal was compacted by someone else, so start over from their snapshot
+			self._load_from_disk()
+		else:
+			self.journal_offset = offset
+			self._apply_records(records)
+
+	def _apply_records(self, records: typing.List[dict]):
+		for record in records:
+			op = record["op"]
+			uri = record["uri"]
+			if op == "new":
+				self._set_item(uri, CacheItem(record["item"]))
+			elif op == "remove":
+				self._pop_item(uri)
+			elif op == "touch":
+				item = self.cache_data.get(uri)
+				if item is not None and item.timestamp < record["timestamp"]:
+					self._set_timestamp(uri, item, record["timestamp"])
+			elif op == "size":
+				item = self.cache_data.get(uri)
+				if item is not None:
+					self._set_item_size(uri, item, record["size"])
+			elif op == "blob":
+				item = self.cache_data.get(uri)
+				if item is not None:
+					self._set_item_blob(item, record["blob"])
+			self.journal_count += 1
+
+	# all changes to cache_data go through these, so the sizes, blob refcounts, and lru order stay up to date
+	def _set_item(self, uri: str, item: CacheItem):
+		self._pop_item(uri)
+		self.cache_data[uri] = item
+		if item.size is None:
+			self._unsized_uris.add(uri)
+		else:
+			self._total_size += item.size
+		if not item.permanent:
+			heapq.heappush(self._lru_heap, (item.timestamp, uri))
+		if item.blob is not None:
+			self._blob_refcounts[item.blob] = self._blob_refcounts.get(item.blob, 0) + 1
+
+	def _pop_item(self, uri: str) -> typing.Optional[CacheItem]:
+		item = self.cache_data.pop(uri, None)
+		if item is not None:
+			self._unsized_uris.discard(uri)
+			self._total_size -= item.size or 0
+			self._release_blob(item.blob)
+		return item
+
+	def _set_item_blob(self, item: CacheItem, blob: typing.Optional[str]):
+		self._release_blob(item.blob)
+		item["blob"] = blob
+		if blob is not None:
+			self._blob_refcounts[blob] = self._blob_refcounts.get(blob, 0) + 1
+
+	def _release_blob(self, blob: typing.Optional[str]):
+		if blob is not None:
+			self._blob_refcounts[blob] -= 1
+			if self._blob_refcounts[blob] == 0:
+				del self._blob_refcounts[blob]
+
+	def _set_item_size(self, uri: str, item: CacheItem, size: int):
+		self._total_size += size - (item.size or 0)
+		self._unsized_uris.discard(uri)
+		item["size"] = size
+
+	def _set_timestamp(self, uri: str, item: CacheItem, timestamp: int):
+		item["timestamp"] = timestamp
+		if not item.permanent:
+			heapq.heappush(self._lru_heap, (timestamp, uri))
+		if len(self._lru_heap) > (2 * len(self.cache_data)) + 1000:
+			# too many stale entries from touches, so rebuild it
+			self._lru_heap = [(item.timestamp, uri) for uri, item in self.cache_data.items() if not item.permanent]
+			heapq.heapify(self._lru_heap)
+
+	# queues up records to be written to the journal when the transaction finishes. should be called inside a transaction
+	def _write_journal(self, records: typing.List[dict]):
+		self._pending_records.extend(records)
+
+	# appends the pending records (and any pending touches) to the journal, compacting it if its gotten too long
+	def _commit(self):
+		if not self._pending_records:
+			return
+		if self.journal_generation is None:
+			self._save_to_disk() # journal from before generations existed, so start a fresh one
+			return
+		records = self._touch_records() + self._pending_records
+		self._pending_records = []
+		self.journal_offset = self.journal.append(records)
+		self.journal_count += len(records)
+		if self.journal_count >= max(CACHE_JOURNAL_COMPACT_RECORDS, len(self.cache_data)):
+			self._save_to_disk()
+
+	def _touch_records(self):
+		records = []
+		for uri in self._touched_uris:
+			item = self.cache_data.get(uri)
+			if item is not None:
+				records.append({ "op": "touch", "uri": uri, "timestamp": item.timestamp })
+		self._touched_uris.clear()
+		return records
+
+	# writes a full snapshot of the index and empties the journal. should be called inside a transaction
+	def _save_to_disk(self):
+		temp_filename = self.cache_index_filename + ".tmp"
+		with open(temp_filename, "wb+") as f:
+			f.write(orjson.dumps(self.cache_data))
+		os.replace(temp_filename, self.cache_index_filename)
+		self.journal_generation = self.journal.reset()
+		self.journal_offset = 0
+		self.journal_count = 0
+		self._touched_uris.clear()
+		self._pending_records = [] # theyre in the snapshot now
+
+	def get(self, uri):
+		item = self.cache_data.get(uri)
+		if item is None:
+			# another process might have added it since we last looked
+			with self.transaction():
+				item = self.cache_data.get(uri)
+		return item
+
+	def put(self, uri, item):
+		with self.transaction():
+			self._set_item(uri, item)
+			self._write_journal([{ "op": "new", "uri": uri, "item": item }])
+
+	def remove(self, uri):
+		with self.transaction():
+			item = self._pop_item(uri)
+			if item is not None:
+				self._write_journal([{ "op": "remove", "uri": uri }])
+			return item
+
+	def touch(self, uri, timestamp):
+		with self._thread_lock:
+			item = self.cache_data.get(uri)
+			if item is not None:
+				self._set_timestamp(uri, item, timestamp)
+				self._touched_uris.add(uri)
+
+	def set_size(self, uri, size):
+		with self.transaction():
+			item = self.cache_data.get(uri)
+			if item is not None and item.size != size:
+				self._set_item_size(uri, item, size)
+				self._write_journal([{ "op": "size", "uri": uri, "size": size }])
+
+	def set_blob(self, uri, blob):
+		with self.transaction():
+			item = self.cache_data.get(uri)
+			if item is not None and item.blob != blob:
+				self._set_item_blob(item, blob)
+				self._write_journal([{ "op": "blob", "uri": uri, "blob": blob }])
+
+	def blob_refcount(self, blob):
+		return self._blob_refcounts.get(blob, 0)
+
+	def get_unsized(self, limit):
+		uris = list(itertools.islice(self._unsized_uris, limit))
+		return [(uri, self.cache_data[uri]) for uri in uris]
+
+	def total_size(self):
+		return self._total_size
+
+	def size_by_prefix(self, separator="."):
+		result = {}
+		with self._thread_lock:
+			for uri, item in self.cache_data.items():
+				prefix = uri.split(separator, 1)[0]
+				count, size = result.get(prefix, (0, 0))
+				result[prefix] = (count + 1, size + (item.size or 0))
+		return result
+
+	def pop_expired(self, timestamp_threshold, limit=None):
+		with self.transaction():
+			if limit is None:
+				expired = []
+				for uri, item in list(self.cache_data.items()):
+					if item.is_expired(timestamp_threshold):
+						expired.append((uri, item))
+						self._pop_item(uri)
+				self._save_to_disk()
+				return expired
+			# the oldest items are at the front of the lru heap
+			expired = []
+			while self._lru_heap and len(expired) < limit and self._lru_heap[0][0] < timestamp_threshold:
+				timestamp, uri = heapq.heappop(self._lru_heap)
+				item = self.cache_data.get(uri)
+				if item is None or item.permanent or item.timestamp != timestamp:
+					continue # stale entry
+				self._pop_item(uri)
+				expired.append((uri, item))
+			if expired:
+				self._write_journal([{ "op": "remove", "uri": uri } for uri, item in expired])
+			return expired
+
+	def pop_least_recently_used(self, limit, bytes_needed):
+		with self.transaction():
+			popped = []
+			while self._lru_heap and len(popped) < limit and bytes_needed > 0:
+				timestamp, uri = heapq.heappop(self._lru_heap)
+				item = self.cache_data.get(uri)
+				if item is None or item.permanent or item.timestamp != timestamp:
+					continue # stale entry
+				self._pop_item(uri)
+				popped.append((uri, item))
+				bytes_needed -= item.size or 0
+			if popped:
+				self._write_journal([{ "op": "remove", "uri": uri } for uri, item in popped])
+			return popped
+
+	def flush(self):
+		with self.transaction():
+			self._save_to_disk()
+
+	def clear(self):
+		with self.transaction():
+			self.journal.close()
+			for filename in [ self.cache_index_filename, self.journal.filename ]:
+				if os.path.exists(filename):
+					os.remove(filename)
+			self.cache_data = {}
+			self.journal_generation = None
+			self.journal_offset = 0
+			self.journal_count = 0
+			self._touched_uris.clear()
+			self._pending_records = []
+			self._total_size = 0
+			self._unsized_uris = set()
+			self._lru_heap = []
+			self._blob_refcounts = {}
+
+	def __len__(self):
+		return len(self.cache_data)
+
+
+class SqliteCacheIndex(CacheIndex):
+	"""
+	The index is stored in a sqlite db (_cache_index.sqlite) in WAL mode, so nothing gets loaded up front and any number
+	of processes can read it at once. Lookups are done one uri at a time, and expiry is one DELETE on the timestamp index.
+	The total size of the items is kept up to date by triggers, so checking it doesnt need to scan anything
+	"""
+	SCHEMA_VERSION = 4
+
+	def __init__(self, cache_dir: str):
+		super().__init__(cache_dir)
+		self.db_filename = os.path.join(self.cache_dir, CACHE_SQLITE_FILENAME)
+		self._connection = None
+		self._thread_lock = threading.RLock()
+		self._transaction_depth = 0
+		self._touches: typing.Dict[str, int] = {}
+
+	@property
+	def filenames(self):
+		return [ CACHE_SQLITE_FILENAME, f"{CACHE_SQLITE_FILENAME}-wal", f"{CACHE_SQLITE_FILENAME}-shm" ]
+
+	# connects the first time its needed, so just constructing the index is free
+	@property
+	def connection(self) -> sqlite3.Connection:
+		if self._connection is None:
+			with self._thread_lock:
+				if self._connection is None:
+					start = time.perf_counter()
+					is_new = not os.path.exists(self.db_filename)
+					connection = sqlite3.connect(self.db_filename, timeout=60, isolation_level=None, check_same_thread=False)
+					connection.execute("PRAGMA journal_mode=WAL")
+					connection.execute("PRAGMA synchronous=NORMAL")
+					self._connection = connection
+					self._create_tables(is_new)
+					self.load_time = time.perf_counter() - start
+		return self._connection
+
+	def _create_tables(self, is_new: bool):
+		with self.transaction():
+			version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+			if version >= self.SCHEMA_VERSION:
+				return
+			if version < 1:
+				self._connection.execute("""
+					CREATE TABLE IF NOT EXISTS items (
+						uri TEXT PRIMARY KEY,
+						filename TEXT NOT NULL,
+						timestamp INTEGER NOT NULL,
+						permanent INTEGER NOT NULL DEFAULT 0
+					)""")
+				self._connection.execute("CREATE INDEX IF NOT EXISTS items_expiry ON items (permanent, timestamp)")
+			if version < 2:
+				self._connection.execute("ALTER TABLE items ADD COLUMN size INTEGER")
+				self._connection.execute("CREATE INDEX items_unsized ON items (uri) WHERE size IS NULL")
+				self._connection.execute("CREATE TABLE totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+				self._connection.execute("INSERT INTO totals (name, value) VALUES ('size', 0)")
+				triggers = [
+					"""CREATE TRIGGER items_size_insert AFTER INSERT ON items WHEN NEW.size IS NOT NULL BEGIN
+						UPDATE totals SET value = value + NEW.size WHERE name = 'size';
+					END""",
+					"""CREATE TRIGGER items_size_delete AFTER DELETE ON items WHEN OLD.size IS NOT NULL BEGIN
+						UPDATE totals SET value = value - OLD.size WHERE name = 'size';
+					END""",
+					"""CREATE TRIGGER items_size_update AFTER UPDATE OF size ON items BEGIN
+						UPDATE totals SET value = value + COALESCE(NEW.size, 0) - COALESCE(OLD.size, 0) WHERE name = 'size';
+					END"""
+				]
+				for trigger in triggers:
+					self._connection.execute(trigger)
+			if version < 3:
+				self._connection.execute("ALTER TABLE items ADD COLUMN blob TEXT")
+				self._connection.execute("CREATE INDEX items_blob ON items (blob) WHERE blob IS NOT NULL")
+			if version < 4:
+				self._connection.execute("ALTER TABLE items ADD COLUMN codec TEXT")
+			self._connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+			if is_new:
+				self._import_json_index()
+
+	# brings over the entries from the json index, if thats what this cache used before
+	def _import_json_index(self):
+		if not os.path.exists(os.path.join(self.cache_dir, CACHE_INDEX_FILENAME)):
+			if not os.path.exists(os.path.join(self.cache_dir, CACHE_JOURNAL_FILENAME)):
+				return
+		json_index = JsonCacheIndex(self.cache_dir)
+		self._connection.executemany(self.UPSERT_QUERY, [self._item_to_row(uri, item) for uri, item in json_index.cache_data.items()])
+		json_index.journal.close()
+
+	@contextlib.contextmanager
+	def transaction(self):
+		connection = self.connection
+		with self._thread_lock:
+			if self._transaction_depth == 0:
+				connection.execute("BEGIN IMMEDIATE")
+			self._transaction_depth += 1
+			try:
+				yield
+			except:
+				self._transaction_depth -= 1
+				if self._transaction_depth == 0:
+					connection.execute("ROLLBACK")
+				raise
+			self._transaction_depth -= 1
+			if self._transaction_depth == 0:
+				self._write_touches()
+				connection.execute("COMMIT")
+
+	def _write_touches(self):
+		if self._touches:
+			touches = [(timestamp, uri, timestamp) for uri, timestamp in self._touches.items()]
+			self._touches = {}
+			self.connection.executemany("UPDATE items SET timestamp = ? WHERE uri = ? AND timestamp < ?", touches)
+
+	ITEM_COLUMNS = "filename, timestamp, permanent, size, blob, codec"
+	UPSERT_QUERY = f"""
+		INSERT INTO items (uri, {ITEM_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)
+		ON CONFLICT (uri) DO UPDATE SET
+			filename = excluded.filename, timestamp = excluded.timestamp, permanent = excluded.permanent,
+			size = excluded.size, blob = excluded.blob, codec = excluded.codec"""
+
+	def _row_to_item(self, row) -> CacheItem:
+		return CacheItem({
+			"filename": row[0],
+			"timestamp": row[1],
+			"permanent": bool(row[2]),
+			"size": row[3],
+			"blob": row[4],
+			"codec": row[5]
+		})
+
+	def _item_to_row(self, uri: str, item: CacheItem):
+		return (uri, item.filename, item.timestamp, 1 if item.permanent else 0, item.size, item.blob, item.codec)
+
+	def get(self, uri):
+		with self._thread_lock:
+			row = self.connection.execute(f"SELECT {self.ITEM_COLUMNS} FROM items WHERE uri = ?", (uri,)).fetchone()
+			if row is None:
+				return None
+			item = self._row_to_item(row)
+			if uri in self._touches:
+				item["timestamp"] = max(item.timestamp, self._touches[uri])
+			return item
+
+	def put(self, uri, item):
+		with self.transaction():
+			self._touches.pop(uri, None)
+			self.connection.execute(self.UPSERT_QUERY, self._item_to_row(uri, item))
+
+	def remove(self, uri):
+		with self.transaction():
+			item = self.get(uri)
+			if item is not None:
+				self._touches.pop(uri, None)
+				self.connection.execute("DELETE FROM items WHERE uri = ?", (uri,))
+			return item
+
+	def touch(self, uri, timestamp):
+		with self._thread_lock:
+			self._touches[uri] = timestamp
+			if len(self._touches) >= CACHE_SQLITE_TOUCH_BATCH and self._transaction_depth == 0:
+				with self.transaction():
+					pass # touches get written on commit
+
+	def set_size(self, uri, size):
+		with self.transaction():
+			self.connection.execute("UPDATE items SET size = ? WHERE uri = ? AND size IS NOT ?", (size, uri, size))
+
+	def set_blob(self, uri, blob):
+		with self.transaction():
+			self.connection.execute("UPDATE items SET blob = ? WHERE uri = ?", (blob, uri))
+
+	def blob_refcount(self, blob):
+		with self._thread_lock:
+			return self.connection.execute("SELECT COUNT(*) FROM items WHERE blob = ?", (blob,)).fetchone()[0]
+
+	def get_unsized(self, limit):
+		with self._thread_lock:
+			rows = self.connection.execute(f"SELECT uri, {self.ITEM_COLUMNS} FROM items WHERE size IS NULL LIMIT ?", (limit,)).fetchall()
+			return [(row[0], self._row_to_item(row[1:])) for row in rows]
+
+	def total_size(self):
+		with self._thread_lock:
+			return self.connection.execute("SELECT value FROM totals WHERE name = 'size'").fetchone()[0]
+
+	def size_by_prefix(self, separator="."):
+		with self._thread_lock:
+			prefix = "substr(uri, 1, instr(uri || ?, ?) - 1)"
+			rows = self.connection.execute(f"SELECT {prefix}, COUNT(*), COALESCE(SUM(size), 0) FROM items GROUP BY 1", (separator, separator)).fetchall()
+			return { row[0]: (row[1], row[2]) for row in rows }
+
+	def pop_expired(self, timestamp_threshold, limit=None):
+		with self.transaction():
+			self._write_touches()
+			query_end = "FROM items WHERE permanent = 0 AND timestamp < ?"
+			if limit is None:
+				rows = self.connection.execute(f"SELECT uri, {self.ITEM_COLUMNS} {query_end}", (timestamp_threshold,)).fetchall()
+				self.connection.execute(f"DELETE {query_end}", (timestamp_threshold,))
+			else:
+				rows = self.connection.execute(f"SELECT uri, {self.ITEM_COLUMNS} {query_end} ORDER BY timestamp LIMIT ?", (timestamp_threshold, limit)).fetchall()
+				self.connection.executemany("DELETE FROM items WHERE uri = ?", [(row[0],) for row in rows])
+			return [(row[0], self._row_to_item(row[1:])) for row in rows]
+
+	def pop_least_recently_used(self, limit, bytes_needed):
+		with self.transaction():
+			self._write_touches()
+			query = f"SELECT uri, {self.ITEM_COLUMNS} FROM items WHERE permanent = 0 ORDER BY timestamp LIMIT ?"
+			popped = []
+			for row in self.connection.execute(query, (limit,)).fetchall():
+				if bytes_needed <= 0:
+					break
+				item = self._row_to_item(row[1:])
+				popped.append((row[0], item))
+				bytes_needed -= item.size or 0
+			self.connection.executemany("DELETE FROM items WHERE uri = ?", [(uri,) for uri, item in popped])
+			return popped
+
+	def flush(self):
+		with self.transaction():
+			pass # touches get written on commit
+		self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+	def clear(self):
+		with self.transaction():
+			self._touches = {}
+			self.connection.execute("DELETE FROM items")
+
+	def __len__(self):
+		with self._thread_lock:
+			return self.connection.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+CACHE_INDEX_ENGINES: typing.Dict[str, typing.Type[CacheIndex]] = {
+	"sqlite": SqliteCacheIndex,
+	"json": JsonCacheIndex
+}
@@ -0,0 +1,76 @@
+import threading
+import time
+import traceback
+import typing
+
+if typing.TYPE_CHECKING:
+	from .cache import Cache
+
+# a background thread that expires and evicts cache files in long-running processes (web backend, discord bot)
+
+CACHE_JANITOR_INTERVAL = 60 # seconds between runs
+CACHE_JANITOR_SLICE = 0.05 # seconds each run is allowed to take, so it never holds the index for long
+CACHE_JANITOR_BATCH = 20 # items expired/evicted per transaction
+
+class CacheJanitor:
+	"""
+	Every interval seconds, removes expired files and evicts files if the cache is over its byte budget. This is done in
+	small batches until either theres nothing left to do or slice_seconds is used up, and whatever is left over gets done
+	on the next run
+	"""
+	def __init__(self, cache: 'Cache', interval: float = CACHE_JANITOR_INTERVAL, slice_seconds: float = CACHE_JANITOR_SLICE):
+		self.cache = cache
+		self.interval = interval
+		self.slice_seconds = slice_seconds
+		self.runs = 0
+		self.last_run: typing.Optional[float] = None # unix time
+		self.last_run_removed = 0
+		self._stop_event = threading.Event()
+		self._thread: typing.Optional[threading.Thread] = None
+
+	@property
+	def running(self):
+		return self._thread is not None and self._thread.is_alive()
+
+	def start(self):
+		if self.running:
+			return
+		self._stop_event.clear()
+		self._thread = threading.Thread(target=self._run, name="kewi-cache-janitor", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout: typing.Optional[float] = None):
+		self._stop_event.set()
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+
+	def _run(self):
+		while not self._stop_event.wait(self.interval):
+			try:
+				self.run_slice()
+			except Exception:
+				traceback.print_exc() # keep going, itll probably work next time
+
+	# does one time-bounded slice of work. returns how many files were removed
+	def run_slice(self) -> int:
+		deadline = time.perf_counter() + self.slice_seconds
+		removed = 0
+		while time.perf_counter() < deadline:
+			count = self.cache.expire(CACHE_JANITOR_BATCH) + self.cache.evict(CACHE_JANITOR_BATCH)
+			removed += count
+			if count == 0:
+				break
+		self.runs += 1
+		self.last_run = time.time()
+		self.last_run_removed = removed
+		return removed
+
+	def stats(self) -> dict:
+		return {
+			"running": self.running,
+			"interval": self.interval,
+			"runs": self.runs,
+			"last_run": self.last_run,
+			"last_run_removed": self.last_run_removed
+		}
@@ -0,0 +1,165 @@
+from __future__ import annotations
+import functools
+import hashlib
+import inspect
+import json
+import orjson
+import pickle
+import re
+import string
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+if typing.TYPE_CHECKING:
+	from .cache import Cache
+
+# the cache.memoize() decorator, which saves the return values of a function in the cache
+
+class CacheSerializer:
+	def __init__(self, extension: str, dumps: typing.Callable[[typing.Any], bytes], loads: typing.Callable[[bytes], typing.Any]):
+		self.extension = extension
+		self.dumps = dumps
+		self.loads = loads
+
+def _bytes_only(value) -> bytes:
+	if not isinstance(value, (bytes, bytearray, memoryview)):
+		raise TypeError(f"format 'bytes' needs the function to return bytes, not '{type(value).__name__}'")
+	return bytes(value)
+
+MEMOIZE_FORMATS: typing.Dict[str, CacheSerializer] = {
+	"json": CacheSerializer("json", lambda value: json.dumps(value, indent="\t").encode("utf-8"), lambda data: json.loads(data)),
+	"orjson": CacheSerializer("json", orjson.dumps, orjson.loads),
+	"pickle": CacheSerializer("pickle", lambda value: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+	"bytes": CacheSerializer("bin", _bytes_only, lambda data: data)
+}
+
+_MISSING = object()
+
+# a call thats currently being computed, that other calls with the same arguments can wait on
+class _InFlightCall:
+	def __init__(self):
+		self.event = threading.Event()
+		self.result = None
+		self.error = None
+
+
+class CacheMemoizer:
+	"""
+	Wraps a function so its return values get saved in the cache, under a uri made from its arguments.
+
+	The uri_template gets formatted with the function's arguments (like "dota.matches.match_{match_id}"), and a hash of
+	the arguments it doesnt reference gets appended to it, so calls that only differ in those still get their own uri. If
+	it references all of them, nothing gets appended. Values are kept in a small in-process LRU in front of the cache, and
+	if multiple threads call it with the same arguments at once, only one of them computes it
+	"""
+	def __init__(self, cache: Cache, func: typing.Callable, uri_template: str, ttl: typing.Optional[float] = None, format: str = "json", maxsize: int = 128):
+		if format not in MEMOIZE_FORMATS:
+			raise ValueError(f"Invalid memoize format '{format}'")
+		self.cache = cache
+		self.func = func
+		self.uri_template = uri_template
+		self.ttl = ttl # in seconds
+		self.serializer = MEMOIZE_FORMATS[format]
+		self.maxsize = maxsize
+		self.signature = inspect.signature(func)
+		# just the argument names, for fields like {user.name} or {ids[0]}
+		self.template_fields = { re.split(r"[.\[]", field, 1)[0] for _, field, _, _ in string.Formatter().parse(uri_template) if field }
+		self._memory: OrderedDict[str, typing.Tuple[float, typing.Any]] = OrderedDict()
+		self._in_flight: typing.Dict[str, _InFlightCall] = {}
+		self._lock = threading.Lock()
+		functools.update_wrapper(self, func)
+
+	# gets the uri that the return value for these arguments is stored at
+	def uri_for(self, *args, **kwargs) -> str:
+		bound = self.signature.bind(*args, **kwargs)
+		bound.apply_defaults()
+		if not self.template_fields:
+			uri = self.uri_template
+		else:
+			uri = self.uri_template.format(**bound.arguments)
+		other_args = sorted((name, value) for name, value in bound.arguments.items() if name not in self.template_fields)
+		if self.template_fields and not other_args:
+			return uri
+		args_hash = hashlib.sha1(repr(other_args).encode("utf-8")).hexdigest()[:16]
+		return f"{uri}.{args_hash}"
+
+	def _is_fresh(self, stored_time: float):
+		return self.ttl is None or (time.time() - stored_time) < self.ttl
+
+	def _memory_get(self, uri: str):
+		with self._lock:
+			entry = self._memory.get(uri)
+			if entry is None:
+				return _MISSING
+			stored_time, value = entry
+			if not self._is_fresh(stored_time):
+				del self._memory[uri]
+				return _MISSING
+			self._memory.move_to_end(uri)
+			return value
+
+	def _memory_put(self, uri: str, stored_time: float, value):
+		if self.maxsize <= 0:
+			return
+		with self._lock:
+			self._memory[uri] = (stored_time, value)
+			self._memory.move_to_end(uri)
+			while len(self._memory) > self.maxsize:
+				self._memory.popitem(last=False)
+
+	# returns (stored_time, value) from the cache, or _MISSING
+	def _disk_get(self, uri: str):
+		stat = self.cache.stat(uri)
+		if stat is None:
+			return _MISSING
+		stored_time = stat.st_mtime
+		if not self._is_fresh(stored_time):
+			return _MISSING
+		data = self.cache.get(uri, "bytes") # decompresses it if needed
+		if data is None:
+			return _MISSING
+		return stored_time, self.serializer.loads(data.getvalue())
+
+	def __call__(self, *args, **kwargs):
+		uri = self.uri_for(*args, **kwargs)
+		value = self._memory_get(uri)
+		if value is not _MISSING:
+			return value
+
+		with self._lock:
+			call = self._in_flight.get(uri)
+			is_leader = call is None
+			if is_leader:
+				call = _InFlightCall()
+				self._in_flight[uri] = call
+		if not is_leader:
+			call.event.wait()
+			if call.error is not None:
+				raise call.error
+			return call.result
+
+		try:
+			entry = self._disk_get(uri)
+			if entry is _MISSING:
+				value = self.func(*args, **kwargs)
+				self.cache.put(uri, self.serializer.dumps(value), self.serializer.extension)
+				stored_time = time.time()
+			else:
+				stored_time, value = entry
+			self._memory_put(uri, stored_time, value)
+			call.result = value
+			return value
+		except BaseException as e:
+			call.error = e
+			raise
+		finally:
+			with self._lock:
+				del self._in_flight[uri]
+			call.event.set()
+
+	# forgets the in-process values. the ones saved in the cache stay
+	def cache_clear(self):
+		with self._lock:
+			self._memory.clear()
@@ -1,31 +1,31 @@
 import typing
-from PIL import Image
+import asyncio
+import collections
 
 import json
 import websocket #NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
+import aiohttp
 import uuid
 import json
 import urllib.request
 import urllib.parse
 import os
-from PIL import Image
 import io
 import kewi
 from kewi.args import KewiArg
-from mutagen.mp4 import MP4, MP4FreeForm
+from .media.mp4meta import read_ilst
+from .media.pngmeta import read_png_text
 
 # MAYBE JUST GETS THE PROMPT? NMOT SURE
 def read_file_metadata(filename):
-	data = ""
+	data = None
 	if filename.endswith("mp4"):
-		video = MP4(filename)
-		for value in video.tags.values():
+		for value in (read_ilst(filename) or {}).values():
 			for item in value:
-				if item.startswith('{"prompt"'):
+				if isinstance(item, str) and item.startswith('{"prompt"'):
 					data = item
 	else:
-		img = Image.open(filename)
-		data = img.info["prompt"]
+		data = read_png_text(filename).get("prompt")
 
 	if data is None:
 		raise Exception("Invalid input file, no prompt metadata")
@@ -56,8 +56,11 @@ class ComfyUiMetadata:
 			nodes = list(filter(lambda n: n.type == type, nodes))
 		return nodes
 	
+	def to_json_text(self) -> str:
+		return json.dumps(self._json)
+
 	def save_json_file(self, fullpath):
-		text = json.dumps(self._json)
+		text = self.to_json_text()
 		with open(fullpath, "w+", encoding="utf-8") as f:
 			f.write(text)
 
@@ -70,9 +73,9 @@ class ComfyUiMetadata:
 	@classmethod
 	def from_image_file(cls, fullpath):
 		# try:
-		img = Image.open(fullpath)
-		if "workflow" in img.info:
-			return ComfyUiMetadata(json.loads(img.info["workflow"]))
+		texts = read_png_text(fullpath)
+		if "workflow" in texts:
+			return ComfyUiMetadata(json.loads(texts["workflow"]))
 		return None
 		# except Exception as e:
 		# 	return None
@@ -91,6 +94,15 @@ class BadWorkflow(Exception):
 		super().__init__(message)
 		self.message = message
 
+# the ids of the nodes linked into a node's inputs (links look like [node_id, output_index])
+def _get_input_ids(data: dict) -> typing.List[str]:
+	input_nodes = []
+	for value in data.get("inputs", {}).values():
+		if isinstance(value, list):
+			if len(value) > 0 and isinstance(value[0], str):
+				input_nodes.append(value[0])
+	return input_nodes
+
 class ComfyUiWorkflowNode:
 	def __init__(self, workflow: 'ComfyUiWorkflow', id: str, data: dict):
 		self.workflow = workflow
@@ -107,29 +119,23 @@ class ComfyUiWorkflowNode:
 	
 	@title.setter
 	def title(self, value: str):
+		old_title = self.title
 		if self.data.get("_meta", None) is None:
 			self.data["_meta"] = {}
 		self.data["_meta"]["title"] = value
+		self.workflow._retitle(self, old_title)
 	
 	@property
-	def input_ids(self):
-		input_nodes = []
-		for value in self.data.get("inputs", {}).values():
-			if isinstance(value, list):
-				if len(value) > 0 and isinstance(value[0], str):
-					input_nodes.append(value[0])
-		return input_nodes
+	def input_ids(self) -> typing.List[str]:
+		return self.workflow._inputs.get(self.id) or _get_input_ids(self.data)
 	
 	def get_output_nodes(self) -> typing.List['ComfyUiWorkflowNode']:
-		nodes = []
-		for node in self.workflow.nodes:
-			if self.id in node.input_ids:
-				nodes.append(node)
-		return nodes
+		return self.workflow.get_output_nodes(self.id)
 	
+	# 1 + how many nodes this depends on (directly or not). ignored_node_ids are left out, and get added to as it goes
 	def get_depth(self, ignored_node_ids: typing.List[str] = None) -> int:
 		if ignored_node_ids is None:
-			ignored_node_ids = []
+			return self.workflow.get_depth(self.id)
 		
 		depth = 1
 		for node_id in self.input_ids:
@@ -137,25 +143,115 @@ class ComfyUiWorkflowNode:
 				continue
 			ignored_node_ids.append(node_id)
 			node = self.workflow.get_node(node_id)
-			depth += node.get_depth(ignored_node_ids)
+			if node is not None:
+				depth += node.get_depth(ignored_node_ids)
 		
 		return depth
 
 
 class ComfyUiWorkflow:
+	"""
+	Besides the list of nodes, this keeps indexes of them by id, type, and title, and which nodes link to which in both
+	directions, so lookups dont need to go through every node. Nodes should be removed with remove_node() so the indexes
+	stay right, and if a node's links get changed by editing its data directly, call reindex() after
+	"""
 	def __init__(self, data: dict, cleanup = True):
 		self.nodes: typing.List[ComfyUiWorkflowNode] = []
 		for node_id in data:
 			node = ComfyUiWorkflowNode(self, node_id, data[node_id])
 			self.nodes.append(node)
+		self.reindex()
 		if cleanup:
 			self.cleanup()
+
+	# rebuilds all the indexes from the nodes
+	def reindex(self):
+		self._nodes_by_id: typing.Dict[str, ComfyUiWorkflowNode] = {}
+		self._positions: typing.Dict[str, int] = {} # where each node is in self.nodes, for keeping lookups in the same order
+		self._inputs: typing.Dict[str, typing.List[str]] = {}
+		self._outputs: typing.Dict[str, typing.List[str]] = {}
+		self._nodes_by_type: typing.Dict[str, typing.List[ComfyUiWorkflowNode]] = {}
+		self._nodes_by_title: typing.Dict[str, typing.List[ComfyUiWorkflowNode]] = {}
+		for position, node in enumerate(self.nodes):
+			self._nodes_by_id[node.id] = node
+			self._positions[node.id] = position
+			self._inputs[node.id] = _get_input_ids(node.data)
+			self._nodes_by_type.setdefault(node.node_type, []).append(node)
+			self._nodes_by_title.setdefault(node.title, []).append(node)
+		for node in self.nodes:
+			self._outputs.setdefault(node.id, [])
+			for input_id in dict.fromkeys(self._inputs[node.id]): # once each, even if its linked to more than one input
+				self._outputs.setdefault(input_id, []).append(node.id)
+		self._clear_memos()
+
+	def _clear_memos(self):
+		self._depths: typing.Dict[str, int] = {}
+		self._topological_order: typing.Optional[typing.List[ComfyUiWorkflowNode]] = None
+
+	def _retitle(self, node: ComfyUiWorkflowNode, old_title: str):
+		if self._nodes_by_id.get(node.id) is not node:
+			return # not in the workflow anymore
+		self._nodes_by_title[old_title].remove(node)
+		if not self._nodes_by_title[old_title]:
+			del self._nodes_by_title[old_title]
+		nodes = self._nodes_by_title.setdefault(node.title, [])
+		nodes.append(node)
+		nodes.sort(key=lambda n: self._positions[n.id])
 	
 	def get_node(self, node_id: str):
-		for node in self.nodes:
-			if node.id == node_id:
-				return node
-		return None
+		return self._nodes_by_id.get(node_id, None)
+
+	# the nodes that take the node's output as one of their inputs
+	def get_output_nodes(self, node_id: str) -> typing.List[ComfyUiWorkflowNode]:
+		return [self._nodes_by_id[output_id] for output_id in self._outputs.get(node_id, [])]
+
+	def remove_node(self, node: ComfyUiWorkflowNode):
+		self.nodes.remove(node)
+		del self._nodes_by_id[node.id]
+		self._nodes_by_type[node.node_type].remove(node)
+		self._nodes_by_title[node.title].remove(node)
+		for input_id in dict.fromkeys(self._inputs.pop(node.id)):
+			if input_id in self._outputs:
+				self._outputs[input_id].remove(node.id)
+		# anything still linking to this keeps its link, so it still shows up in input_ids, but not as a node
+		self._outputs.pop(node.id, None)
+		self._positions = { node.id: position for position, node in enumerate(self.nodes) }
+		self._clear_memos()
+
+	# 1 + how many nodes this node depends on, directly or not. these get remembered until the workflow changes
+	def get_depth(self, node_id: str) -> int:
+		depth = self._depths.get(node_id)
+		if depth is None:
+			seen = set()
+			to_visit = list(self._inputs.get(node_id, []))
+			while to_visit:
+				input_id = to_visit.pop()
+				if input_id in seen or input_id not in self._nodes_by_id:
+					continue
+				seen.add(input_id)
+				to_visit.extend(self._inputs[input_id])
+			depth = 1 + len(seen)
+			self._depths[node_id] = depth
+		return depth
+
+	# the nodes ordered so each one comes after all of the nodes it takes input from
+	def topological_order(self) -> typing.List[ComfyUiWorkflowNode]:
+		if self._topological_order is None:
+			remaining_inputs = { node.id: len({ input_id for input_id in self._inputs[node.id] if input_id in self._nodes_by_id }) for node in self.nodes }
+			ready = collections.deque(node.id for node in self.nodes if remaining_inputs[node.id] == 0)
+			order = []
+			while ready:
+				node_id = ready.popleft()
+				order.append(self._nodes_by_id[node_id])
+				for output_id in self._outputs[node_id]:
+					remaining_inputs[output_id] -= 1
+					if remaining_inputs[output_id] == 0:
+						ready.append(output_id)
+			if len(order) != len(self.nodes):
+				stuck = [node.id for node in self.nodes if remaining_inputs[node.id] > 0]
+				raise BadWorkflow(f"Workflow has a cycle between nodes: {', '.join(stuck)}")
+			self._topological_order = order
+		return list(self._topological_order)
 
 	# removes extra preview nodes and makes sure theres atleast one output, and correctly fixes input
 	def cleanup(self, expect_input=True):
@@ -178,7 +274,7 @@ class ComfyUiWorkflow:
 			if node.title != OUTPUT_PREVIEW_NAME:
 				to_remove.append(node)
 		for node in to_remove:
-			self.nodes.remove(node)
+			self.remove_node(node)
 		
 		# CHECK INPUT NODES
 		input_nodes = self.filter_nodes(title=INPUT_NAME)
@@ -191,7 +287,7 @@ class ComfyUiWorkflow:
 			else:
 				message = "Too many file inputs to choose an INPUT. File Inputs:"
 				for node in file_nodes:
-					output_types = ", ".join(list(map(lambda n: n.class_type, node.get_output_nodes())))
+					output_types = ", ".join(list(map(lambda n: n.node_type, node.get_output_nodes())))
 					message += f"\n- [{node.id}] inputs to: ({output_types})"
 				raise BadWorkflow(message)
 
@@ -218,14 +314,14 @@ class ComfyUiWorkflow:
 		input_nodes[0].data["inputs"]["image_path"] = input_image_path
 
 	def filter_nodes(self, title: str = None, type: str = None) -> typing.List[ComfyUiWorkflowNode]:
-		nodes = []
-		for node in self.nodes:
-			if title is not None and node.title != title:
-				continue
-			if type is not None and node.node_type != type:
-				continue
-			nodes.append(node)
-		return nodes
+		if title is None and type is None:
+			return list(self.nodes)
+		if type is None:
+			return list(self._nodes_by_title.get(title, []))
+		nodes = self._nodes_by_type.get(type, [])
+		if title is not None:
+			nodes = [node for node in nodes if node.title == title]
+		return list(nodes)
 	
 	def get_output_node_ids(self):
 		return list(map(lambda n: n.id, self.filter_nodes(title=OUTPUT_PREVIEW_NAME)))
@@ -285,6 +381,121 @@ class ComfyUiApi:
 		return prompt_result
 
 
+MAX_PROMPTS_IN_FLIGHT = 4 # how many prompts ComfyUiAsyncApi has queued on the server at once
+MAX_EARLY_MESSAGE_PROMPTS = 100 # how many unknown prompts to hold onto messages for, in case they're ours but still being queued
+
+class ComfyUiAsyncApi:
+	"""
+	Keeps one websocket open, and hands each message to the ComfyUIPromptResult for the prompt its about (by prompt_id),
+	so a bunch of prompts can be queued and waited on at the same time. Use it with async with, or connect() and close()
+	"""
+	def __init__(self, server_address: str = None, max_in_flight: int = MAX_PROMPTS_IN_FLIGHT):
+		self.server_address = server_address or SERVER_ADDRESS
+		self.client_id = str(uuid.uuid4())
+		self.max_in_flight = max_in_flight
+		self._in_flight = asyncio.Semaphore(max_in_flight)
+		self._session: typing.Optional[aiohttp.ClientSession] = None
+		self._ws: typing.Optional[aiohttp.ClientWebSocketResponse] = None
+		self._receive_task: typing.Optional[asyncio.Task] = None
+		self._prompts: typing.Dict[str, typing.Tuple[ComfyUIPromptResult, asyncio.Future]] = {}
+		# messages can show up before queue_prompt gets the prompt_id back, so they wait here until the prompt is known
+		self._early_messages: typing.Dict[str, typing.List[dict]] = {}
+
+	async def __aenter__(self):
+		await self.connect()
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		await self.close()
+
+	async def connect(self):
+		self._session = aiohttp.ClientSession()
+		self._ws = await self._session.ws_connect(f"ws://{self.server_address}/ws?clientId={self.client_id}", max_msg_size=0)
+		self._receive_task = asyncio.create_task(self._receive_messages())
+
+	async def close(self):
+		if self._receive_task is not None:
+			self._receive_task.cancel()
+			try:
+				await self._receive_task
+			except asyncio.CancelledError:
+				pass
+			self._receive_task = None
+		if self._ws is not None:
+			await self._ws.close()
+			self._ws = None
+		if self._session is not None:
+			await self._session.close()
+			self._session = None
+
+	async def queue_prompt(self, workflow: ComfyUiWorkflow) -> str:
+		p = {"prompt": workflow.to_json(), "client_id": self.client_id}
+		async with self._session.post(f"http://{self.server_address}/prompt", json=p) as response:
+			data = await response.json()
+			if response.status != 200:
+				raise BadWorkflow(f"ComfyUI rejected the prompt: {json.dumps(data)}")
+		return data["prompt_id"]
+
+	# queues the workflow and waits for it to finish, once theres room for it under max_in_flight
+	async def run_workflow(self, workflow: ComfyUiWorkflow) -> 'ComfyUIPromptResult':
+		async with self._in_flight:
+			if self._receive_task is None or self._receive_task.done():
+				raise ConnectionError("Not connected to ComfyUI")
+			prompt_id = await self.queue_prompt(workflow)
+			prompt_result = ComfyUIPromptResult(prompt_id, workflow)
+			future = asyncio.get_running_loop().create_future()
+			self._prompts[prompt_id] = (prompt_result, future)
+			try:
+				for message in self._early_messages.pop(prompt_id, []):
+					self._deliver(prompt_result, future, message)
+				# if the websocket dropped while we were queueing it, nothing is ever going to finish this future
+				if not future.done() and (self._receive_task is None or self._receive_task.done()):
+					raise ConnectionError("Lost the websocket connection to ComfyUI")
+				return await future
+			finally:
+				self._prompts.pop(prompt_id, None)
+
+	# runs all the workflows, returning their results in the same order
+	async def run_workflows(self, workflows: typing.List[ComfyUiWorkflow]) -> typing.List['ComfyUIPromptResult']:
+		return await asyncio.gather(*(self.run_workflow(workflow) for workflow in workflows))
+
+	async def _receive_messages(self):
+		try:
+			async for ws_message in self._ws:
+				if ws_message.type == aiohttp.WSMsgType.TEXT:
+					self._route(json.loads(ws_message.data))
+				elif ws_message.type == aiohttp.WSMsgType.ERROR:
+					break
+				# binary messages are previews, which we dont use
+		finally:
+			for _, future in self._prompts.values():
+				if not future.done():
+					future.set_exception(ConnectionError("Lost the websocket connection to ComfyUI"))
+
+	def _route(self, message: dict):
+		data = message.get("data")
+		prompt_id = data.get("prompt_id") if isinstance(data, dict) else None
+		if prompt_id is None:
+			return # stuff like queue status, which isnt about any one prompt
+		if prompt_id in self._prompts:
+			self._deliver(*self._prompts[prompt_id], message)
+			return
+		if prompt_id not in self._early_messages and len(self._early_messages) >= MAX_EARLY_MESSAGE_PROMPTS:
+			del self._early_messages[next(iter(self._early_messages))] # the oldest, which probably wasnt ours
+		self._early_messages.setdefault(prompt_id, []).append(message)
+
+	def _deliver(self, prompt_result: 'ComfyUIPromptResult', future: asyncio.Future, message: dict):
+		if future.done():
+			return
+		try:
+			prompt_result.ws_message(message)
+		except Exception as e:
+			future.set_exception(e)
+			return
+		if prompt_result.is_done:
+			future.set_result(prompt_result)
+
+
 class ComfyUIPromptResult:
 	def __init__(self, prompt_id: str, workflow: ComfyUiWorkflow):
 		self.prompt_id = prompt_id
@@ -12,7 +12,8 @@ from aiohttp.web_request import Request
 from aiohttp import web
 
 from kewi.args import KewiArg
-from .args import KewiArg, KewiInputError, RunnerBase, args_from_frame, args_set_frame, request_input_console
+from .args import KewiArg, KewiInputError, RunnerBase, TimeSpan, args_from_frame, args_set_frame, request_input_console
+from .data.datasource import data_cursor
 
 
 class TableAlign(Enum):
@@ -22,6 +23,9 @@ class TableAlign(Enum):
 
 KEWI_CONTEXT_GLOBALNAME = "__kewi_current_ctx__"
 
+DATA_PAGE_SIZE = 100 # how many DataItems the web sends per page
+DATA_MAX_PAGE_SIZE = 1000 # the most it can ask for at once with page_size
+
 # # represents the context a given kewi script is called from. this is used to determine things like how we route output from a script 
 class KewiContext(ABC):
 	def __init__(self, arg_inputs: List[Any]):
@@ -81,6 +85,11 @@ class KewiContext(ABC):
 		"""Print a formatted table"""
 		pass
 
+	# source is a DataSource or Timeline. items get printed as they're found, instead of waiting for all of them
+	def print_data(self, source, time: TimeSpan, order: str = "asc") -> None:
+		for item in source.iter_data(time, order=order):
+			self.print(repr(item))
+
 # CONSOLE STUFF
 
 
@@ -143,6 +152,16 @@ class KewiContextConsole(KewiContext):
 
 # Web stuff
 
+# the page_size query param, clamped to 1..DATA_MAX_PAGE_SIZE. anything that isnt a number is a 400
+def parse_page_size(value: str | None) -> int:
+	if value is None or value == "":
+		return DATA_PAGE_SIZE
+	try:
+		page_size = int(value)
+	except ValueError:
+		raise web.HTTPBadRequest(text=f"page_size should be a number, not '{value}'")
+	return max(1, min(page_size, DATA_MAX_PAGE_SIZE))
+
 class KewiContextWebJson(KewiContext):
 	"""
 	A web request called this and the response should be in a json format
@@ -157,16 +176,21 @@ class KewiContextWebJson(KewiContext):
 				arg_inputs.append(arg_value)
 			else:
 				break
+		# which page of DataItems to send for print_data
+		self.data_cursor = query_params.get("cursor")
+		self.data_page_size = parse_page_size(query_params.get("page_size"))
 		self.log_lines = []
 		self.errors = []
 		self.html_items = []
+		self.data_pages = []
 		super().__init__(arg_inputs)
 	
 	def to_web_response(self):
 		json = {
 			"text": self.log_lines,
 			"errors": self.errors,
-			"html": self.html_items
+			"html": self.html_items,
+			"data": self.data_pages
 		}
 		return web.json_response(json)
 	
@@ -219,6 +243,16 @@ class KewiContextWebJson(KewiContext):
 			row_str = " | ".join(format_cell(str(row[i]), col_widths[i], align[i]) for i in range(column_count))
 			self.print(row_str)
 
+	# only gets the one page that was asked for, with a cursor to ask for the next one (null if this is the last page)
+	def print_data(self, source, time: TimeSpan, order: str = "asc") -> None:
+		# one extra item, to know if there's another page
+		items = list(source.iter_data(time, order=order, limit=self.data_page_size + 1, cursor=self.data_cursor))
+		page = items[:self.data_page_size]
+		self.data_pages.append({
+			"items": [item.to_json() for item in page],
+			"next_cursor": data_cursor(page[-1]) if len(items) > len(page) else None
+		})
+
 	def show_text_file(self, file_path: str) -> None:
 		with open(file_path, "r") as f:
 			text = f.read()
@@ -3,23 +3,37 @@ from ..args import TimeSpan
 from abc import ABC, abstractmethod
 from ..args import TimeSpan
 from ..utils import SimpleTimer
+import itertools
 import typing
 
+ORDER_ASC = "asc"
+ORDER_DESC = "desc"
+
+T = typing.TypeVar("T")
+
 class DataItem(ABC):
+	# slotted, since sources can have a lot of items. subclasses should give their own __slots__ for the same reason
+	__slots__ = ("uri", "timestamp", "title", "description", "link", "info", "color")
+
 	# Inherited properties
 	uri: str
 	timestamp: TimeSpan
 
 	# Abstract properties
-	title: typing.Optional[str] = None
-	description: typing.Optional[str] = None
-	link: typing.Optional[str] = None
-	info: typing.Optional[dict] = None
-	color: typing.Optional[str] = None
+	title: typing.Optional[str]
+	description: typing.Optional[str]
+	link: typing.Optional[str]
+	info: typing.Optional[dict]
+	color: typing.Optional[str]
 
 	def __init__(self, uri: str, timestamp: TimeSpan):
 		self.uri = uri
 		self.timestamp = timestamp
+		self.title = None
+		self.description = None
+		self.link = None
+		self.info = None
+		self.color = None
 	
 	def __repr__(self):
 		result = f"] {self.uri}"
@@ -32,6 +46,56 @@ class DataItem(ABC):
 		result += "\n" + str(self.timestamp)
 		return result
 
+	def to_json(self) -> dict:
+		return {
+			"uri": self.uri,
+			"start": self.timestamp.start.isoformat(),
+			"end": self.timestamp.end.isoformat(),
+			"title": self.title,
+			"description": self.description,
+			"link": self.link,
+			"color": self.color
+		}
+
+
+# items are ordered by start time, and then uri so that items starting at the same time still have a set order
+def data_order_key(item: DataItem) -> typing.Tuple[float, str]:
+	return (item.timestamp.start.timestamp(), item.uri)
+
+# an opaque string marking the last item of a page, so the next page can start right after it (see DataSource.iter_data)
+def data_cursor(item: DataItem) -> str:
+	start, uri = data_order_key(item)
+	return f"{start!r}|{uri}"
+
+def parse_data_cursor(cursor: str) -> typing.Tuple[float, str]:
+	start, _, uri = cursor.partition("|")
+	try:
+		return (float(start), uri)
+	except ValueError:
+		raise ValueError(f"Invalid data cursor: {cursor}")
+
+def is_descending(order: str) -> bool:
+	if order not in (ORDER_ASC, ORDER_DESC):
+		raise ValueError(f"order should be '{ORDER_ASC}' or '{ORDER_DESC}', not '{order}'")
+	return order == ORDER_DESC
+
+# takes items that are already sorted by start time (backwards for desc), and lazily applies the order/limit/cursor for iter_data
+# order_key can be given to paginate things that arent DataItems yet, as long as it matches data_order_key of what they become
+def paginate(items: typing.Iterable[T], order: str = ORDER_ASC, limit: typing.Optional[int] = None, cursor: typing.Optional[str] = None, order_key: typing.Callable[[T], typing.Tuple[float, str]] = data_order_key) -> typing.Iterator[T]:
+	reverse = is_descending(order)
+	# only items with the same start need sorting by uri, so this only ever holds one group at a time
+	groups = itertools.groupby(items, key=lambda item: order_key(item)[0])
+	items = itertools.chain.from_iterable(sorted(group, key=order_key, reverse=reverse) for _, group in groups)
+	if cursor is not None:
+		after = parse_data_cursor(cursor)
+		if reverse:
+			items = itertools.dropwhile(lambda item: order_key(item) >= after, items)
+		else:
+			items = itertools.dropwhile(lambda item: order_key(item) <= after, items)
+	if limit is not None:
+		items = itertools.islice(items, limit)
+	return items
+
 
 class DataSource(ABC):
 	@abstractmethod
@@ -44,6 +108,19 @@ class DataSource(ABC):
 		"""Fetch data based on the provided TimeSpan."""
 		pass
 
+	def iter_data(self, time: TimeSpan, order: str = ORDER_ASC, limit: typing.Optional[int] = None, cursor: typing.Optional[str] = None) -> typing.Iterator[DataItem]:
+		"""
+		Lazily yields the data for the TimeSpan in time order ("asc" or "desc"), stopping after limit items. To get the next
+		page, pass data_cursor() of the last item as the cursor. By default this just sorts get_data(), so sources that can
+		find their items in order should override it
+		"""
+		items = sorted(self.get_data(time), key=lambda item: item.timestamp.start.timestamp(), reverse=is_descending(order))
+		return paginate(items, order, limit, cursor)
+
+	def on_files_changed(self, changes: typing.List[typing.Tuple[str, typing.Optional[dict]]]):
+		"""Called with (filename, info) for each batch of files this data source is watching that changed (see FileInfoCache.watch). info is None if it was deleted"""
+		pass
+
 	def log(self, message: str):
 		print(f"[DataSource Log] {message}")
 	
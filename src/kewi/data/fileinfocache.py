@@ -1,70 +1,319 @@
 import kewi
 import orjson
 import typing
+import fnmatch
+import hashlib
 import os
+import sqlite3
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from .filewatch import FileWatcher, create_file_watcher, FILE_DELETED, POLL_INTERVAL
 
 # a way to cache information about a set of files, and be able to tell when files have changed
 
+# how often refresh() saves what its done so far, in seconds
+REFRESH_CHECKPOINT_SECONDS = 30
+
+# called with a list of (filename, info) for the watched files that changed together, with info as None if it was deleted or
+# couldnt be loaded
+FileChangedCallback = typing.Callable[[typing.List[typing.Tuple[str, typing.Optional[typing.Dict]]]], None]
+
+# the parts of a file's stat that tell us whether its changed
+def _file_key(file_stat: os.stat_result, inode: int) -> typing.Dict:
+	return {
+		"mtime": file_stat.st_mtime,
+		"mtime_ns": file_stat.st_mtime_ns,
+		"size": file_stat.st_size,
+		"inode": inode
+	}
+
+# calls info_func, returning (info, error). this is at the module level so process pools can pickle it
+def _load_info(info_func: typing.Callable[[str], typing.Dict], filename: str):
+	try:
+		return info_func(filename), None
+	except Exception as e:
+		return None, f"{type(e).__name__}: {e}"
+
+FILE_KEY_COLUMNS = ("mtime", "mtime_ns", "size", "inode")
+
 class FileInfoCache:
+	"""
+	Stored as a sqlite db in the cache, with one row per file. Only the stat info of each file (what we need to tell if
+	its changed) is loaded up front, and each file's info is only read and decoded when its asked for. Changes are written
+	to their rows as they happen, and committed by save()
+	"""
 	def __init__(self, uri: str):
 		self.cache_uri = uri
-		self.cache_file = kewi.cache.get_filename(self.cache_uri)
-		print(f"CACHED: {self.cache_file}")
-		if self.cache_file is None:
-			self.cache_file = kewi.cache.new(self.cache_uri, "json")
-			self.data = {
-				"files": {}
-			}
-			self.save()
-		else:
-			self.load()
-		
+		self.watchers: typing.List[FileWatcher] = []
+		self._subscribers: typing.List[FileChangedCallback] = []
+		self._lock = threading.RLock()
+		# permanent, so it doesnt get evicted out from under us while its open
+		self.db_filename = kewi.cache.new(f"{self.cache_uri}.db", "sqlite", permanent=True)
+		self._connection = sqlite3.connect(self.db_filename, timeout=60, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL")
+		self._connection.execute("PRAGMA synchronous=NORMAL")
+		self._connection.execute("""
+			CREATE TABLE IF NOT EXISTS files (
+				filename TEXT PRIMARY KEY,
+				info BLOB,
+				error TEXT,
+				mtime REAL,
+				mtime_ns INTEGER,
+				size INTEGER,
+				inode INTEGER
+			)""")
+		self._import_json()
+		print(f"CACHED: {self.cache_uri}")
+		self.files: typing.Dict[str, typing.Dict] = {} # the stat info and error for each file
+		self.load()
+
+	# brings over the files from when this was stored as one big json file
+	def _import_json(self):
+		data = kewi.cache.get(self.cache_uri, "json")
+		if data is None:
+			return
+		rows = []
+		for key, entry in data["files"].items():
+			info = entry.get("info")
+			rows.append((key, orjson.dumps(info) if info is not None else None, entry.get("error"), *(entry.get(name) for name in FILE_KEY_COLUMNS)))
+		self._connection.executemany("INSERT OR REPLACE INTO files (filename, info, error, mtime, mtime_ns, size, inode) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+		self._connection.commit()
+		kewi.cache.remove(self.cache_uri)
+
 	def load(self):
-		with open(self.cache_file, "rb") as f:
-			self.data = orjson.loads(f.read())
+		with self._lock:
+			self.files = {}
+			for row in self._connection.execute("SELECT filename, error, mtime, mtime_ns, size, inode FROM files"):
+				entry = dict(zip(FILE_KEY_COLUMNS, row[2:]))
+				if row[1] is not None:
+					entry["error"] = row[1]
+				self.files[row[0]] = entry
 	
+	# commits the changes made so far
 	def save(self):
-		text = orjson.dumps(self.data)
-		with open(self.cache_file, "wb+") as f:
-			f.write(text)
-	
-	@property
-	def files(self):
-		return self.data["files"]
+		with self._lock:
+			self._connection.commit()
+
+	def close(self):
+		self.stop_watching()
+		with self._lock:
+			self._connection.commit()
+			self._connection.close()
 
 	# gets the info from the cache
 	def get(self, filename) -> typing.Dict:
-		return self.files.get(filename).get("info")
+		with self._lock:
+			row = self._connection.execute("SELECT info FROM files WHERE filename = ?", (filename,)).fetchone()
+		if row is None or row[0] is None:
+			return None
+		return orjson.loads(row[0])
 
 	# adds the file to the cache
 	def add_file(self, file: str):
 		if not file in self.files:
-			self.files[file] = {
-				"info": None,
-				"mtime": None
-			}
+			with self._lock:
+				self.files[file] = { name: None for name in FILE_KEY_COLUMNS }
+				self._connection.execute("INSERT OR IGNORE INTO files (filename) VALUES (?)", (file,))
+
+	def _remove_file(self, file: str):
+		with self._lock:
+			if self.files.pop(file, None) is None:
+				return False
+			self._connection.execute("DELETE FROM files WHERE filename = ?", (file,))
+			return True
+
+	# records the result of loading the file's info
+	def _set_result(self, file: str, file_key: typing.Dict, info: typing.Optional[typing.Dict], error: typing.Optional[str]):
+		with self._lock:
+			entry = self.files.get(file)
+			if entry is None:
+				return # a watcher saw it get deleted while it was loading
+			if error is None:
+				entry.update(file_key)
+				entry.pop("error", None)
+			else:
+				entry.update({ name: None for name in file_key }) # so it gets retried
+				entry["error"] = error
+			self._connection.execute("UPDATE files SET info = ?, error = ?, mtime = ?, mtime_ns = ?, size = ?, inode = ? WHERE filename = ?",
+				(orjson.dumps(info) if info is not None else None, error, *(entry[name] for name in FILE_KEY_COLUMNS), file))
+
+	def _set_file_key(self, file: str, file_key: typing.Dict):
+		with self._lock:
+			self.files[file].update(file_key)
+			self._connection.execute("UPDATE files SET mtime = ?, mtime_ns = ?, size = ?, inode = ? WHERE filename = ?", (*(file_key[name] for name in FILE_KEY_COLUMNS), file))
+
+	# forgets the stat info of the files, so the next refresh/sync reloads their info even if they look unchanged
+	def invalidate(self, files: typing.Iterable[str]):
+		with self._lock:
+			for file in files:
+				entry = self.files.get(file)
+				if entry is None:
+					continue
+				entry.update({ name: None for name in FILE_KEY_COLUMNS })
+				self._connection.execute("UPDATE files SET mtime = NULL, mtime_ns = NULL, size = NULL, inode = NULL WHERE filename = ?", (file,))
+			self._connection.commit()
+
+	# a hash of the stat info of every file, which changes whenever any file's info might have. useful for knowing when
+	# something derived from all the infos needs to be rebuilt
+	def state_key(self) -> str:
+		with self._lock:
+			state = sorted((key, *(entry.get(name) for name in FILE_KEY_COLUMNS), entry.get("error")) for key, entry in self.files.items())
+		return hashlib.sha1(orjson.dumps(state)).hexdigest()
 
  	# adds files to the ones we pay attention to. existing ones are ignored
 	def add_files(self, files: typing.List[str]):
 		for file in files:
 			self.add_file(file)
 
-	# returns an iterator to iterate through each key, info pair.
+	# returns an iterator to iterate through each key, info pair. each info is only decoded when its reached
 	def iterate(self) -> typing.Iterator[typing.Tuple[str, typing.Dict]]:
-		for key, value in self.files.items():
-			info = value.get("info")
-			yield key, info 
-
-	# reloads the info for each thing in the cache, using info_func to get the info for it, then saves the cache
-	def refresh(self, info_func: typing.Callable[[str], typing.Dict]):
-		for key in self.files:
-			if os.path.isfile(key):
-				last_mtime = self.files[key].get("mtime")
-				mtime = os.path.getmtime(key)
-				if last_mtime is None or last_mtime != mtime:
-					# TODO: WRAP THIS IN A TRY/CATCH, AND SAVE THE CACHEFILE BEFORE RETHROWING
-					info = info_func(key)
-					self.files[key]["info"] = info
-					self.files[key]["mtime"] = mtime
-		self.save()
+		with self._lock:
+			rows = self._connection.execute("SELECT filename, info FROM files").fetchall()
+		for key, info in rows:
+			yield key, orjson.loads(info) if info is not None else None
+
+	# reloads the info for each file that changed since it was last loaded, using info_func to get the info for it.
+	# the files are spread across a pool of workers (processes if use_processes, which needs info_func to be picklable, so
+	# defined at the top level of a module), and the cache gets saved every checkpoint_seconds and at the end, even if
+	# this is interrupted. if info_func raises for a file, the error gets recorded for it and it'll be retried next refresh.
+	# returns the errors for the files that failed
+	def refresh(self, info_func: typing.Callable[[str], typing.Dict], workers: int = None, use_processes: bool = True, checkpoint_seconds: float = REFRESH_CHECKPOINT_SECONDS) -> typing.Dict[str, str]:
+		changed_files = []
+		with self._lock: # a watcher's thread could be changing them
+			keys = list(self.files)
+		for key in keys:
+			try:
+				file_stat = os.stat(key)
+			except OSError:
+				continue
+			if not stat.S_ISREG(file_stat.st_mode):
+				continue
+			file_key = _file_key(file_stat, file_stat.st_ino)
+			with self._lock:
+				if key in self.files and self._is_changed(key, file_key):
+					changed_files.append((key, file_key))
+		return self._load_changed(info_func, changed_files, workers, use_processes, checkpoint_seconds)
+
+	# adds the files in root_dir that match the pattern, forgets the ones that were deleted, and reloads the info for the
+	# ones that changed (see refresh()). this is a single os.scandir pass over the directory, which on windows gets the
+	# stat info along with the listing, so already-known files that havent changed cost nothing extra
+	def sync(self, root_dir: str, pattern: str, info_func: typing.Callable[[str], typing.Dict], workers: int = None, use_processes: bool = True, checkpoint_seconds: float = REFRESH_CHECKPOINT_SECONDS) -> typing.Dict[str, str]:
+		seen_files = set()
+		changed_files = []
+		with os.scandir(root_dir) as dir_entries:
+			for dir_entry in dir_entries:
+				if not fnmatch.fnmatch(dir_entry.name, pattern) or not dir_entry.is_file():
+					continue
+				key = dir_entry.path
+				try:
+					file_key = _file_key(dir_entry.stat(), dir_entry.inode()) # (the stat's st_ino is 0 on windows)
+				except OSError:
+					continue # deleted since it was listed
+				seen_files.add(key)
+				with self._lock: # a watcher's thread could be changing the files
+					self.add_file(key)
+					if self._is_changed(key, file_key):
+						changed_files.append((key, file_key))
+
+		dirname = os.path.dirname(os.path.join(root_dir, ""))
+		with self._lock:
+			deleted_files = [key for key in self.files if key not in seen_files and os.path.dirname(key) == dirname and fnmatch.fnmatch(os.path.basename(key), pattern)]
+		for key in deleted_files:
+			if not os.path.exists(key): # a watcher might have added it after the scan
+				self._remove_file(key)
+		return self._load_changed(info_func, changed_files, workers, use_processes, checkpoint_seconds)
+
+	def _is_changed(self, key: str, file_key: typing.Dict):
+		entry = self.files[key]
+		if entry.get("mtime_ns") is None:
+			# from before sizes and inodes were recorded
+			if entry.get("mtime") is None or entry["mtime"] != file_key["mtime"]:
+				return True
+			self._set_file_key(key, file_key)
+			return False
+		return any(entry.get(name) != file_key[name] for name in ("size", "mtime_ns", "inode"))
+
+	# loads the info for the changed files, saving as it goes
+	def _load_changed(self, info_func, changed_files: typing.List[typing.Tuple[str, typing.Dict]], workers: int, use_processes: bool, checkpoint_seconds: float):
+		failures = {}
+		last_checkpoint = time.perf_counter()
+		try:
+			for key, file_key, (info, error) in self._load_infos(info_func, changed_files, workers, use_processes):
+				self._set_result(key, file_key, info, error)
+				if error is not None:
+					failures[key] = error
+				if time.perf_counter() - last_checkpoint > checkpoint_seconds:
+					self.save()
+					last_checkpoint = time.perf_counter()
+		finally:
+			self.save()
+		return failures
+
+	# keeps the files up to date as they get created, changed, or deleted, using inotify on linux or polling every
+	# poll_interval seconds elsewhere. the subscribers get told about each batch of changes. sync() should be called first to catch up
+	# on what changed while we werent watching. call stop_watching() to stop
+	def watch(self, root_dir: str, pattern: str, info_func: typing.Callable[[str], typing.Dict], poll_interval: float = POLL_INTERVAL) -> FileWatcher:
+		watcher = create_file_watcher(root_dir, pattern, lambda events: self._on_file_events(events, info_func), poll_interval)
+		watcher.start()
+		self.watchers.append(watcher)
+		return watcher
+
+	def stop_watching(self):
+		for watcher in self.watchers:
+			watcher.stop()
+		self.watchers = []
+
+	# the callback gets called (on the watcher's thread) with [(filename, info), ...] for each batch of changes the watcher sees
+	def subscribe(self, callback: FileChangedCallback):
+		self._subscribers.append(callback)
+
+	def unsubscribe(self, callback: FileChangedCallback):
+		self._subscribers.remove(callback)
+
+	def _on_file_events(self, events: typing.List[typing.Tuple[str, str]], info_func):
+		changes = []
+		with self._lock:
+			for event, key in events:
+				if event == FILE_DELETED:
+					if self._remove_file(key):
+						changes.append((key, None))
+					continue
+				try:
+					file_stat = os.stat(key)
+				except OSError:
+					continue # already gone again
+				self.add_file(key)
+				file_key = _file_key(file_stat, file_stat.st_ino)
+				if not self._is_changed(key, file_key):
+					continue
+				info, error = _load_info(info_func, key)
+				self._set_result(key, file_key, info, error)
+				changes.append((key, info))
+			if changes:
+				self.save()
+		if changes:
+			for callback in list(self._subscribers):
+				callback(changes)
+
+	# yields (filename, file_key, (info, error)) for each of the files, as they finish loading
+	def _load_infos(self, info_func, files: typing.List[typing.Tuple[str, typing.Dict]], workers: int, use_processes: bool):
+		if workers is None:
+			workers = os.cpu_count() or 1
+		if workers <= 1 or len(files) <= 1:
+			for key, file_key in files:
+				yield key, file_key, _load_info(info_func, key)
+			return
+		pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+		with pool_class(max_workers=min(workers, len(files))) as pool:
+			futures = { pool.submit(_load_info, info_func, key): (key, file_key) for key, file_key in files }
+			try:
+				for future in as_completed(futures):
+					key, file_key = futures[future]
+					yield key, file_key, future.result()
+			finally:
+				# if we're stopping early, dont wait for the pool to finish all the rest first
+				for future in futures:
+					future.cancel()
 
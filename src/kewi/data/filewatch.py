@@ -0,0 +1,202 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import sys
+import threading
+import traceback
+import typing
+from abc import ABC, abstractmethod
+
+# watches a directory for files being created, changed, or deleted. uses inotify on linux, and polls everywhere else
+
+FILE_CHANGED = "changed" # created or modified
+FILE_DELETED = "deleted"
+
+# called with a list of (event, path), in the order they happened
+FileEventsCallback = typing.Callable[[typing.List[typing.Tuple[str, str]]], None]
+
+POLL_INTERVAL = 5 # seconds
+
+class FileWatcher(ABC):
+	"""
+	Watches the files directly in root_dir that match the pattern, calling the callback (on the watcher's own thread) with
+	each batch of changes
+	"""
+	def __init__(self, root_dir: str, pattern: str, callback: FileEventsCallback):
+		self.root_dir = root_dir
+		self.pattern = pattern
+		self.callback = callback
+		self._stop_event = threading.Event()
+		self._thread: typing.Optional[threading.Thread] = None
+
+	@property
+	def running(self):
+		return self._thread is not None and self._thread.is_alive()
+
+	def start(self):
+		if self.running:
+			return
+		self._stop_event.clear()
+		self._thread = threading.Thread(target=self._run, name=f"kewi-filewatch-{os.path.basename(self.root_dir)}", daemon=True)
+		self._thread.start()
+
+	def stop(self, timeout: typing.Optional[float] = None):
+		self._stop_event.set()
+		if self._thread is not None:
+			self._thread.join(timeout)
+			self._thread = None
+
+	def _matches(self, name: str):
+		return fnmatch.fnmatch(name, self.pattern)
+
+	# the matching files, as {path: (size, mtime_ns, inode)}
+	def _scan(self) -> typing.Dict[str, typing.Tuple[int, int, int]]:
+		result = {}
+		with os.scandir(self.root_dir) as dir_entries:
+			for dir_entry in dir_entries:
+				if self._matches(dir_entry.name) and dir_entry.is_file():
+					file_stat = dir_entry.stat()
+					result[dir_entry.path] = (file_stat.st_size, file_stat.st_mtime_ns, dir_entry.inode())
+		return result
+
+	def _emit(self, events: typing.List[typing.Tuple[str, str]]):
+		if not events:
+			return
+		try:
+			self.callback(events)
+		except Exception:
+			traceback.print_exc() # dont let one bad event stop the watching
+
+	@abstractmethod
+	def _run(self):
+		"""Watches for changes until _stop_event is set, passing them to _emit()"""
+		pass
+
+
+class PollingFileWatcher(FileWatcher):
+	"""Rescans the directory every interval seconds, and compares (size, mtime_ns, inode) with the last scan"""
+	def __init__(self, root_dir: str, pattern: str, callback: FileEventsCallback, interval: float = POLL_INTERVAL):
+		super().__init__(root_dir, pattern, callback)
+		self.interval = interval
+		self._last_scan = self._scan() # done up front, so changes made right after this get noticed
+
+	def _run(self):
+		while not self._stop_event.wait(self.interval):
+			try:
+				scan = self._scan()
+			except OSError:
+				traceback.print_exc()
+				continue
+			events = []
+			for path, key in scan.items():
+				if self._last_scan.get(path) != key:
+					events.append((FILE_CHANGED, path))
+			for path in self._last_scan:
+				if path not in scan:
+					events.append((FILE_DELETED, path))
+			self._last_scan = scan
+			self._emit(events)
+
+
+# from linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+class InotifyFileWatcher(FileWatcher):
+	"""
+	Uses inotify, so changes show up right away without rescanning. A file counts as changed once its been closed after
+	writing, so half-written files dont get picked up. If the kernel's event queue overflows and events get dropped, the
+	directory gets rescanned, and every file in it is reported as changed, along with the ones that are gone since
+	"""
+	def __init__(self, root_dir: str, pattern: str, callback: FileEventsCallback):
+		super().__init__(root_dir, pattern, callback)
+		self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self._fd: typing.Optional[int] = None
+		self._known_paths: typing.Set[str] = set() # what's there as far as the events have told us, for finding deletes on overflow
+		self._open() # done up front, so changes made right after this get noticed, and so failures show up here
+
+	def _open(self):
+		fd = self._libc.inotify_init1(IN_CLOEXEC)
+		if fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+		watch_descriptor = self._libc.inotify_add_watch(fd, os.fsencode(self.root_dir), mask)
+		if watch_descriptor < 0:
+			errno = ctypes.get_errno()
+			os.close(fd)
+			raise OSError(errno, f"inotify_add_watch failed for {self.root_dir}")
+		self._fd = fd
+		self._known_paths = set(self._scan()) # after the watch is added, so nothing falls in between
+
+	def start(self):
+		# the fd gets closed when the watching stops, so starting again needs a new one
+		if not self.running and self._fd is None:
+			self._open()
+		super().start()
+
+	def _run(self):
+		fd = self._fd
+		try:
+			while not self._stop_event.is_set():
+				# wake up every second to check if we've been stopped
+				readable, _, _ = select.select([fd], [], [], 1)
+				if readable:
+					self._emit(self._read_events(os.read(fd, 64 * 1024)))
+		finally:
+			os.close(fd)
+			self._fd = None
+
+	def _read_events(self, buffer: bytes) -> typing.List[typing.Tuple[str, str]]:
+		events = []
+		offset = 0
+		while offset + INOTIFY_EVENT_HEADER.size <= len(buffer):
+			_, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+			offset += INOTIFY_EVENT_HEADER.size
+			name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b"\0"))
+			offset += name_length
+			if mask & IN_Q_OVERFLOW:
+				events.extend(self._rescan()) # its always the last event in the queue
+				continue
+			if mask & (IN_ISDIR | IN_IGNORED) or not name or not self._matches(name):
+				continue
+			path = os.path.join(self.root_dir, name)
+			if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+				events.append((FILE_CHANGED, path))
+				self._known_paths.add(path)
+			elif mask & (IN_DELETE | IN_MOVED_FROM):
+				events.append((FILE_DELETED, path))
+				self._known_paths.discard(path)
+		return events
+
+	# after events got dropped, theres no telling what changed, so everything thats there counts as changed (whoever's
+	# listening can skip the ones that turn out not to be), and anything we knew about thats gone now counts as deleted
+	def _rescan(self) -> typing.List[typing.Tuple[str, str]]:
+		try:
+			scan = self._scan()
+		except OSError:
+			traceback.print_exc()
+			return []
+		events = [(FILE_CHANGED, path) for path in scan]
+		events.extend((FILE_DELETED, path) for path in self._known_paths if path not in scan)
+		self._known_paths = set(scan)
+		return events
+
+
+# the best watcher for this platform. falls back to polling if inotify isnt available
+def create_file_watcher(root_dir: str, pattern: str, callback: FileEventsCallback, poll_interval: float = POLL_INTERVAL) -> FileWatcher:
+	if sys.platform.startswith("linux"):
+		try:
+			return InotifyFileWatcher(root_dir, pattern, callback)
+		except (OSError, AttributeError):
+			pass # out of watches, or no inotify in this libc
+	return PollingFileWatcher(root_dir, pattern, callback, poll_interval)
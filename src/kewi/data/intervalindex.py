@@ -0,0 +1,98 @@
+import array
+import typing
+from ..args import TimeSpan
+
+# an index for quickly finding which items overlap a span of time
+
+T = typing.TypeVar("T")
+
+class IntervalIndex(typing.Generic[T]):
+	"""
+	The items are sorted by start time, and treated as an implicit balanced binary tree (the middle item of each range is
+	the root of that range), where each node knows the latest end time in its subtree. A query skips any subtree that ends
+	before the query starts, and anything that starts after the query ends, so it takes about O(log n + k) for k results.
+	The index is immutable, so build a new one when the items change
+	"""
+	def __init__(self, items: typing.Iterable[T], get_span: typing.Callable[[T], TimeSpan] = lambda item: item.timestamp):
+		spans = []
+		for item in items:
+			span = get_span(item)
+			spans.append((span.start.timestamp(), span.end.timestamp(), item))
+		self._set_spans(spans)
+
+	# for when the items already know their start/end times, as epoch seconds, so no TimeSpans need to be made
+	@classmethod
+	def from_bounds(cls, items: typing.Iterable[T], get_bounds: typing.Callable[[T], typing.Tuple[float, float]]) -> 'IntervalIndex[T]':
+		index = cls.__new__(cls)
+		index._set_spans([(*get_bounds(item), item) for item in items])
+		return index
+
+	# spans is a list of (start, end, item)
+	def _set_spans(self, spans: typing.List[typing.Tuple[float, float, T]]):
+		spans.sort(key=lambda span: span[0])
+		# arrays of doubles, so each time takes 8 bytes instead of a whole float object
+		self._starts = array.array("d", (span[0] for span in spans))
+		self._ends = array.array("d", (span[1] for span in spans))
+		self._items: typing.List[T] = [span[2] for span in spans]
+		self._max_ends = array.array("d", self._ends)
+		self._build(0, len(self._items))
+
+	# fills in _max_ends for the subtree of [lo, hi), returning its max end
+	def _build(self, lo: int, hi: int) -> float:
+		if lo >= hi:
+			return float("-inf")
+		mid = (lo + hi) // 2
+		max_end = max(self._ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+		self._max_ends[mid] = max_end
+		return max_end
+
+	def __len__(self):
+		return len(self._items)
+
+	# returns the items that overlap the span (starting before it ends, and ending after it starts), in order of start time
+	def query(self, span: TimeSpan) -> typing.List[T]:
+		query_start = span.start.timestamp()
+		query_end = span.end.timestamp()
+		results = []
+		ranges = [(0, len(self._items))]
+		while ranges:
+			lo, hi = ranges.pop()
+			if lo >= hi:
+				continue
+			mid = (lo + hi) // 2
+			if self._max_ends[mid] <= query_start:
+				continue # nothing in here ends after the query starts
+			if self._starts[mid] < query_end:
+				if self._ends[mid] > query_start:
+					results.append(mid)
+				ranges.append((mid + 1, hi))
+			ranges.append((lo, mid))
+		results.sort()
+		return [self._items[i] for i in results]
+
+	# like query, but yields the items one at a time as it finds them (in order of start time, or the reverse), so the
+	# caller can stop early without the rest of the tree getting searched
+	def iter_query(self, span: TimeSpan, reverse: bool = False) -> typing.Iterator[T]:
+		query_start = span.start.timestamp()
+		query_end = span.end.timestamp()
+		# ranges are (lo, hi), and (index, None) is an item thats ready to be yielded
+		stack = [(0, len(self._items))]
+		while stack:
+			lo, hi = stack.pop()
+			if hi is None:
+				yield self._items[lo]
+				continue
+			if lo >= hi:
+				continue
+			mid = (lo + hi) // 2
+			if self._max_ends[mid] <= query_start:
+				continue # nothing in here ends after the query starts
+			if self._starts[mid] >= query_end:
+				stack.append((lo, mid)) # only the left side can start before the query ends
+				continue
+			# pushed so that the side that comes first gets popped first
+			first, last = ((mid + 1, hi), (lo, mid)) if reverse else ((lo, mid), (mid + 1, hi))
+			stack.append(last)
+			if self._ends[mid] > query_start:
+				stack.append((mid, None))
+			stack.append(first)
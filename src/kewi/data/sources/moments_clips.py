@@ -1,66 +1,81 @@
 # video_clips_data_source.py
-import os
 import kewi
 from datetime import datetime, timedelta
 from dateutil import parser as dateutil_parser
 import typing
-from mutagen.mp4 import MP4, MP4FreeForm
-import json
-import os
+import orjson
 from ...args import TimeSpan
 from ..fileinfocache import FileInfoCache
-from ..datasource import DataSource, DataItem
+from ..datasource import DataSource, DataItem, ORDER_ASC, ORDER_DESC, paginate
+from ..intervalindex import IntervalIndex
+from ...media.mp4meta import read_video_json
 import pytz
 
-def unicode_key(n):
-	return (n + 1).to_bytes(4, byteorder='big').decode('latin1')
-
-def read_video_json(video_path, just_get_lavf = False):
-	print(f"LOADING: {video_path}")
-	video = MP4(video_path)
-	jsontext = ""
-	for key in video.tags:
-		value = video.tags[key]
-		value_shortened = str(value)
-		if len(value_shortened) > 50:
-			value_shortened = value_shortened[:50 - 3] + "..."
-	i = 0
-	while True:
-		key = unicode_key(i)
-		if key not in video.tags:
-			break
-		value = video.tags[key]
-		if isinstance(value, list):
-			value = value[0]
-		if value.startswith("Lavf"):
-			if just_get_lavf:
-				return value
-			break
-		
-		jsontext += value
-		i += 1
-	
-	if jsontext == "":
-		return None # EMPTYYYYYY
+# the parts of a clip needed to find it and show it, with the dates already parsed into epoch seconds.
+# these get saved in a snapshot, so starting up again doesnt need to re-parse every clip's info
+class ClipEntry:
+	__slots__ = ("file_path", "uri", "start", "end", "title", "game_id", "clip")
+
+	def __init__(self, file_path: str, uri: str, start: float, end: float, title: str, game_id):
+		self.file_path = file_path
+		self.uri = uri
+		self.start = start
+		self.end = end
+		self.title = title
+		self.game_id = game_id
+		self.clip: typing.Optional[VideoClip] = None # made the first time a query returns this
+
+	@classmethod
+	def from_info(cls, file_path: str, info: dict) -> 'ClipEntry':
+		date = dateutil_parser.parse(info["recording_timestamp"])
+		start = (date + timedelta(seconds=info["clip_start_point"])).timestamp()
+		end = (date + timedelta(seconds=info["clip_end_point"])).timestamp()
+		date_ms = int(date.timestamp() * 1000)
+		return ClipEntry(file_path, f"data.clips.{date_ms}", start, end, info["name"], info["library_game_unique_id"])
+
+	def to_row(self) -> list:
+		return [self.file_path, self.uri, self.start, self.end, self.title, self.game_id]
 
-	jsontext = jsontext.replace("\r", "")
-	return json.loads(jsontext)
+	@classmethod
+	def from_row(cls, row: list) -> 'ClipEntry':
+		return ClipEntry(*row)
+
+	# same rules as TimeSpan.intersects, with the span as epoch seconds
+	def intersects(self, start: float, end: float) -> bool:
+		return (
+			self.start < start and self.end > end
+			or start < self.start and end > self.start
+			or start < self.end and end > self.end
+		)
 
 # Derived from DataItem
 class VideoClip(DataItem):
-	def __init__(self, file_path: str, info: dict):
-		self.info = info
-		date = dateutil_parser.parse(self.info["recording_timestamp"])
-		start_date = date + timedelta(seconds=self.info["clip_start_point"])
-		end_date = date + timedelta(seconds=self.info["clip_end_point"])
-		date_ms = int(date.timestamp() * 1000)
-		uri = f"data.clips.{date_ms}"
-		super().__init__(uri, TimeSpan(start_date, end_date))
+	__slots__ = ("_info", "_source")
+
+	# if info isnt given, its loaded from the source's infocache each time its used, so clips dont all hold onto their raw info.
+	# the infocache is looked up through the source, since re-initializing the source replaces it
+	def __init__(self, file_path: str, info: typing.Optional[dict], entry: typing.Optional[ClipEntry] = None, source: typing.Optional['ClipsDataSource'] = None):
+		if entry is None:
+			entry = ClipEntry.from_info(file_path, info)
+		start_date = datetime.fromtimestamp(entry.start, tz=pytz.utc)
+		end_date = datetime.fromtimestamp(entry.end, tz=pytz.utc)
+		super().__init__(entry.uri, TimeSpan(start_date, end_date))
+		self._info = info
+		self._source = source
 		self.link = file_path
-		self.title = self.info["name"]
-		seconds_length = self.info["clip_end_point"] - self.info["clip_start_point"]
-		game_id = self.info["library_game_unique_id"]
-		self.description = f"{int(seconds_length)} sec clip. Game ID: {game_id}"
+		self.title = entry.title
+		seconds_length = round(entry.end - entry.start, 3) # rounded, so float error doesnt take a second off
+		self.description = f"{int(seconds_length)} sec clip. Game ID: {entry.game_id}"
+
+	@property
+	def info(self) -> typing.Optional[dict]:
+		if self._info is None and self._source is not None and self._source.infocache is not None:
+			return self._source.infocache.get(self.link) # not kept, since whoever asked for it can hold onto it if they need
+		return self._info
+
+	@info.setter
+	def info(self, info: typing.Optional[dict]):
+		self._info = info
 
 	@classmethod
 	def load(cls, file_path: str):
@@ -70,38 +85,115 @@ class VideoClip(DataItem):
 		clip = VideoClip(file_path, info)
 		return clip
 
+# bump this when ClipEntry changes, so old snapshots get rebuilt
+CLIPS_SNAPSHOT_VERSION = 1
+
 # Derived from DataSource
 class ClipsDataSource(DataSource):
-	def __init__(self):
-		self.clips: typing.List[VideoClip] = []
+	"""
+	Keeps a ClipEntry for each clip, and only makes the VideoClips for the clips a query returns. The entries are saved in
+	a snapshot in the cache along with the FileInfoCache's state_key, so if no clip files changed since the last time,
+	they get loaded straight from there
+	"""
+	# watch keeps the clips up to date as files get added/changed/deleted, for long-running processes
+	def __init__(self, watch: bool = False):
+		self.entries: typing.List[ClipEntry] = []
+		self.clip_index: IntervalIndex[ClipEntry] = IntervalIndex.from_bounds([], _entry_bounds)
 		self.root_dir = kewi.globals.Moments.ROOT_DIR
+		self.watch = watch
+		self.infocache: typing.Optional[FileInfoCache] = None
+		self.snapshot_uri = "filecache.clips_snapshot"
 		self.initialize()
 
+	# every clip, as VideoClips. this makes all of them, so prefer get_data/iter_data
+	@property
+	def clips(self) -> typing.List[VideoClip]:
+		return [self._get_clip(entry) for entry in self.entries]
+
 	def initialize(self):
 		self.log("Initializing VideoClipsDataSource.")
-		self.clips  = []
+		self.entries = []
+		if self.infocache is not None:
+			self.infocache.close()
 		
 		infocache = FileInfoCache("filecache.clips_infos")
+		self.infocache = infocache
 
-		with self.log_timer("Getting file list"):
-			for filename in os.listdir(self.root_dir):
-				file_path = os.path.join(self.root_dir, filename)
-
-				if os.path.isfile(file_path) and file_path.endswith(".mp4"):
-					infocache.add_file(file_path)
-		
 		with self.log_timer("Loading Clip Infos"):
-			infocache.refresh(read_video_json)
+			failures = infocache.sync(self.root_dir, "*.mp4", read_video_json)
+			for file_path, error in failures.items():
+				self.log(f"Failed to load {file_path}: {error}")
 		
-		with self.log_timer("Loading as VideoClips"):
-			for file_path, info in infocache.iterate():
-				if info is not None:
-					self.clips.append(VideoClip(file_path, info))
+		state_key = infocache.state_key()
+		entries = self._load_snapshot(state_key)
+		if entries is None:
+			with self.log_timer("Loading as ClipEntries"):
+				entries = []
+				for file_path, info in infocache.iterate():
+					if info is not None:
+						entries.append(ClipEntry.from_info(file_path, info))
+			self._save_snapshot(state_key, entries)
+
+		self._set_entries(entries)
+		self.log(f"Found {len(self.entries)} video clips.")
+		if self.watch:
+			infocache.subscribe(self.on_files_changed)
+			infocache.watch(self.root_dir, "*.mp4", read_video_json)
+		return self.entries
+
+	def _load_snapshot(self, state_key: str) -> typing.Optional[typing.List[ClipEntry]]:
+		with self.log_timer("Loading Clips Snapshot"):
+			snapshot = kewi.cache.get(self.snapshot_uri, "json")
+			if snapshot is None or snapshot.get("version") != CLIPS_SNAPSHOT_VERSION or snapshot.get("state_key") != state_key:
+				return None
+			return [ClipEntry.from_row(row) for row in snapshot["clips"]]
 
-		self.log(f"Found {len(self.clips)} video clips.")
-		return self.clips
+	def _save_snapshot(self, state_key: str, entries: typing.List[ClipEntry]):
+		snapshot = {
+			"version": CLIPS_SNAPSHOT_VERSION,
+			"state_key": state_key,
+			"clips": [entry.to_row() for entry in entries]
+		}
+		kewi.cache.put(self.snapshot_uri, orjson.dumps(snapshot), "json")
+
+	def _set_entries(self, entries: typing.List[ClipEntry]):
+		# replaced all at once, so queries never see them half-updated
+		self.clip_index = IntervalIndex.from_bounds(entries, _entry_bounds)
+		self.entries = entries
+
+	def _get_clip(self, entry: ClipEntry) -> VideoClip:
+		if entry.clip is None:
+			entry.clip = VideoClip(entry.file_path, None, entry, self)
+		return entry.clip
+
+	# the whole batch gets applied before the index is rebuilt and the snapshot is saved, so a burst of changes only does it once
+	def on_files_changed(self, changes: typing.List[typing.Tuple[str, typing.Optional[dict]]]):
+		changed = { filename: info for filename, info in changes }
+		entries = [entry for entry in self.entries if entry.file_path not in changed]
+		for filename, info in changed.items():
+			if info is not None:
+				entries.append(ClipEntry.from_info(filename, info))
+			self.log(f"Clip {'updated' if info is not None else 'removed'}: {filename}")
+		self._set_entries(entries)
+		self._save_snapshot(self.infocache.state_key(), entries)
+
+	# the entries that overlap the span, in start order (or the reverse)
+	def _query_entries(self, time: TimeSpan, reverse: bool = False) -> typing.Iterator[ClipEntry]:
+		clip_index = self.clip_index # held onto, so a file changing partway through doesnt switch indexes on us
+		start = time.start.timestamp()
+		end = time.end.timestamp()
+		# the index finds everything that overlaps, and intersects() decides the edge cases same as it always has
+		return (entry for entry in clip_index.iter_query(time, reverse) if entry.intersects(start, end))
 
 	def get_data(self, time: TimeSpan) -> typing.List[VideoClip]:
 		with self.log_timer("Searching VideoClips"):
-			clips = list(filter(lambda c: time.intersects(c.timestamp), self.clips))
+			clips = [self._get_clip(entry) for entry in self._query_entries(time)]
 		return clips
+
+	def iter_data(self, time: TimeSpan, order: str = ORDER_ASC, limit: typing.Optional[int] = None, cursor: typing.Optional[str] = None) -> typing.Iterator[VideoClip]:
+		entries = self._query_entries(time, reverse=order == ORDER_DESC)
+		entries = paginate(entries, order, limit, cursor, order_key=lambda entry: (entry.start, entry.uri))
+		return map(self._get_clip, entries)
+
+def _entry_bounds(entry: ClipEntry) -> typing.Tuple[float, float]:
+	return (entry.start, entry.end)
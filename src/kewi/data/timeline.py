@@ -0,0 +1,94 @@
+import heapq
+import itertools
+import traceback
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from ..args import TimeSpan
+from ..utils import SimpleTimer
+from .datasource import DataSource, DataItem, ORDER_ASC, data_order_key, is_descending, parse_data_cursor
+
+# combines multiple DataSources, so one query can get everything that happened during a span of time
+
+# either a DataSource, or something that makes one (like the class itself), if making it is the slow part
+DataSourceFactory = typing.Union[DataSource, typing.Callable[[], DataSource]]
+
+class Timeline:
+	"""
+	Sources get initialized in parallel threads by initialize(), and each query asks all of them at once, then merges what
+	they return into one list ordered by start time. If a source fails, its error gets printed and the rest still get used
+	"""
+	def __init__(self, sources: typing.List[DataSourceFactory] = None):
+		self._pending: typing.List[DataSourceFactory] = []
+		self.sources: typing.List[DataSource] = []
+		self._executor: typing.Optional[ThreadPoolExecutor] = None
+		for source in sources or []:
+			self.register(source)
+
+	def register(self, source: DataSourceFactory):
+		self._pending.append(source)
+
+	def _get_executor(self) -> ThreadPoolExecutor:
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor(max_workers=max(len(self.sources), 1), thread_name_prefix="kewi-timeline")
+		return self._executor
+
+	# creates/initializes all the registered sources at once. returns the ones that worked
+	def initialize(self) -> typing.List[DataSource]:
+		def init_source(source: DataSourceFactory) -> DataSource:
+			if isinstance(source, DataSource):
+				source.initialize()
+				return source
+			return source() # constructing a DataSource initializes it
+
+		pending = self._pending + self.sources
+		self._pending = []
+		self.sources = []
+		with SimpleTimer("Initializing timeline"):
+			with ThreadPoolExecutor(max_workers=max(len(pending), 1), thread_name_prefix="kewi-timeline-init") as executor:
+				futures = [executor.submit(init_source, source) for source in pending]
+				for future in futures:
+					try:
+						self.sources.append(future.result())
+					except Exception:
+						traceback.print_exc()
+		if self._executor is not None:
+			self._executor.shutdown(wait=False)
+			self._executor = None # so it gets remade with enough threads for the sources
+		return self.sources
+
+	# everything from all the sources that happened during the span, ordered by start time
+	def get_data(self, time: TimeSpan) -> typing.List[DataItem]:
+		executor = self._get_executor()
+		futures = [(source, executor.submit(source.get_data, time)) for source in self.sources]
+		results = []
+		for source, future in futures:
+			try:
+				items = future.result()
+			except Exception:
+				source.log(f"get_data failed:\n{traceback.format_exc()}")
+				continue
+			results.append(sorted(items, key=lambda item: item.timestamp.start))
+		return list(heapq.merge(*results, key=lambda item: item.timestamp.start))
+
+	# like DataSource.iter_data, but over all the sources. each source is only asked for as many items as get used, and a
+	# cursor from here can be passed back in to get the next page
+	def iter_data(self, time: TimeSpan, order: str = ORDER_ASC, limit: typing.Optional[int] = None, cursor: typing.Optional[str] = None) -> typing.Iterator[DataItem]:
+		reverse = is_descending(order)
+		if cursor is not None:
+			parse_data_cursor(cursor) # so a bad cursor is an error, instead of every source failing with it
+		iterators = [self._iter_source(source, time, order, cursor) for source in self.sources]
+		items = heapq.merge(*iterators, key=data_order_key, reverse=reverse)
+		if limit is not None:
+			items = itertools.islice(items, limit)
+		return items
+
+	def _iter_source(self, source: DataSource, time: TimeSpan, order: str, cursor: typing.Optional[str]) -> typing.Iterator[DataItem]:
+		try:
+			yield from source.iter_data(time, order=order, cursor=cursor)
+		except Exception:
+			source.log(f"iter_data failed:\n{traceback.format_exc()}")
+
+	def close(self):
+		if self._executor is not None:
+			self._executor.shutdown()
+			self._executor = None
@@ -0,0 +1,93 @@
+import numpy as np
+import typing
+from datetime import datetime, timezone
+from ..args import TimeSpan
+
+# a bunch of TimeSpans stored as numpy arrays, so they can be filtered/sorted/joined all at once instead of one at a time
+
+T = typing.TypeVar("T")
+
+def to_epoch_ms(date: datetime) -> int:
+	return int(date.timestamp() * 1000)
+
+def from_epoch_ms(epoch_ms: int) -> datetime:
+	return datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc)
+
+class TimeSpanArray:
+	"""
+	The starts and ends are int64 arrays of epoch milliseconds. The methods that check spans return boolean masks (or
+	indexes), so for a data source, keep the items in a list in the same order and pick them out with the results. The
+	comparisons are strict, to match TimeSpan
+	"""
+	def __init__(self, starts: np.ndarray, ends: np.ndarray):
+		self.starts = np.asarray(starts, dtype=np.int64)
+		self.ends = np.asarray(ends, dtype=np.int64)
+		if self.starts.shape != self.ends.shape:
+			raise ValueError("starts and ends need to be the same length")
+
+	@classmethod
+	def from_spans(cls, spans: typing.Iterable[TimeSpan]) -> 'TimeSpanArray':
+		spans = list(spans)
+		starts = np.fromiter((to_epoch_ms(span.start) for span in spans), dtype=np.int64, count=len(spans))
+		ends = np.fromiter((to_epoch_ms(span.end) for span in spans), dtype=np.int64, count=len(spans))
+		return TimeSpanArray(starts, ends)
+
+	@classmethod
+	def from_items(cls, items: typing.Sequence[T], get_span: typing.Callable[[T], TimeSpan] = lambda item: item.timestamp) -> 'TimeSpanArray':
+		return cls.from_spans(get_span(item) for item in items)
+
+	def to_spans(self) -> typing.List[TimeSpan]:
+		return [TimeSpan(from_epoch_ms(start), from_epoch_ms(end)) for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+
+	def __len__(self):
+		return len(self.starts)
+
+	# an int gives a TimeSpan, and anything else numpy can index with (slice, mask, indexes) gives a TimeSpanArray
+	def __getitem__(self, key) -> typing.Union[TimeSpan, 'TimeSpanArray']:
+		if isinstance(key, (int, np.integer)):
+			return TimeSpan(from_epoch_ms(int(self.starts[key])), from_epoch_ms(int(self.ends[key])))
+		return TimeSpanArray(self.starts[key], self.ends[key])
+
+	# which of the spans span.intersects(), with the same rules as TimeSpan.intersects
+	def intersects(self, span: TimeSpan) -> np.ndarray:
+		start = to_epoch_ms(span.start)
+		end = to_epoch_ms(span.end)
+		return (
+			((self.starts < start) & (self.ends > end))
+			| ((start < self.starts) & (end > self.starts))
+			| ((start < self.ends) & (end > self.ends))
+		)
+
+	# which of the spans contain the date (a datetime or epoch ms)
+	def contains(self, date: typing.Union[datetime, int]) -> np.ndarray:
+		if isinstance(date, datetime):
+			date = to_epoch_ms(date)
+		return (self.starts < date) & (self.ends > date)
+
+	# the indexes that would sort the spans by start, then end
+	def argsort(self) -> np.ndarray:
+		return np.lexsort((self.ends, self.starts))
+
+	def sorted(self) -> 'TimeSpanArray':
+		return self[self.argsort()]
+
+	# finds every pair of spans from this and other that overlap (each one starts before the other ends).
+	# returns (indexes into this, indexes into other), sorted by the index into this
+	def overlaps(self, other: 'TimeSpanArray') -> typing.Tuple[np.ndarray, np.ndarray]:
+		if len(self) == 0 or len(other) == 0:
+			return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+		order = other.argsort()
+		other_starts = other.starts[order]
+		other_ends = other.ends[order]
+		# only spans in other that start between (our start - their longest length) and our end can overlap us
+		longest = int((other.ends - other.starts).max())
+		lows = np.searchsorted(other_starts, self.starts - longest, side="left")
+		highs = np.searchsorted(other_starts, self.ends, side="left")
+		counts = np.maximum(highs - lows, 0)
+		self_indexes = np.repeat(np.arange(len(self)), counts)
+		# for each candidate pair, its position within its window, offset by the start of the window
+		window_starts = np.repeat(lows, counts)
+		window_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		other_sorted_indexes = window_starts + window_offsets
+		keep = other_ends[other_sorted_indexes] > self.starts[self_indexes]
+		return self_indexes[keep], order[other_sorted_indexes[keep]]
@@ -6,7 +6,9 @@ import typing
 from .custom_cog import get_custom_cogs
 
 class KewiCog(commands.Cog):
-	pass
+	def __init__(self, bot: commands.InteractionBot):
+		self.bot = bot
+		kewi.cache.start_janitor()
 
 
 def get_cogs(bot: commands.InteractionBot) -> typing.List[commands.Cog]:
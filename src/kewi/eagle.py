@@ -35,13 +35,14 @@ class EagleImage:
 	@property
 	def comfy_metadata(self) -> ComfyUiMetadata:
 		if self._comfyui_metadata == -1:
-			cache_file = kewi.cache.new(f"eagle.images.metadata.{self.eagle_id}_metadata", "json")
-			if os.path.exists(cache_file):
-				self._comfyui_metadata = ComfyUiMetadata.from_json_file(cache_file)
+			cache_uri = f"eagle.images.metadata.{self.eagle_id}_metadata"
+			cached_json = kewi.cache.get(cache_uri, "json")
+			if cached_json is not None:
+				self._comfyui_metadata = ComfyUiMetadata(cached_json)
 			else:
 				self._comfyui_metadata = ComfyUiMetadata.from_image_file(self.fullpath)
-			if self._comfyui_metadata is not None:
-				self._comfyui_metadata.save_json_file(cache_file)
+				if self._comfyui_metadata is not None:
+					kewi.cache.put(cache_uri, self._comfyui_metadata.to_json_text().encode("utf-8"), "json")
 		return self._comfyui_metadata
 
 	@classmethod
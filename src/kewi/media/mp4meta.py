@@ -0,0 +1,244 @@
+import json
+import os
+import struct
+import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+if typing.TYPE_CHECKING:
+	from ..data.fileinfocache import FileInfoCache
+
+# reads the metadata tags out of an mp4 without loading the rest of it. only the atom headers on the way to
+# moov/udta/meta/ilst get read, and everything else (like the multi-GB mdat) just gets seeked past.
+# writing rewrites just the ilst in place when theres room for it, which there usually is, since there's normally free
+# space padding after it
+
+ATOM_HEADER = struct.Struct(">I4s") # size, name
+ATOM_LARGE_SIZE = struct.Struct(">Q")
+DATA_ATOM_TYPE_UTF8 = 1 # the "type" part of a data atom's flags, for text
+
+ILST_PATH = (b"moov", b"udta", b"meta", b"ilst")
+JSON_CHUNK_SIZE = 255 # how many characters of json moments puts in each numbered tag
+
+class Mp4Atom(typing.NamedTuple):
+	name: bytes
+	offset: int # where the atom's header starts
+	data_offset: int # where its contents start
+	end: int
+
+class Mp4MetaError(Exception):
+	pass
+
+# walks the atoms between start and end (the end of the file if None), by reading each header and seeking past the contents
+def iter_atoms(f: typing.BinaryIO, start: int = 0, end: typing.Optional[int] = None) -> typing.Iterator[Mp4Atom]:
+	if end is None:
+		end = f.seek(0, os.SEEK_END)
+	offset = start
+	while offset + ATOM_HEADER.size <= end:
+		f.seek(offset)
+		size, name = ATOM_HEADER.unpack(f.read(ATOM_HEADER.size))
+		data_offset = offset + ATOM_HEADER.size
+		if size == 1: # the real size didnt fit, so its in the next 8 bytes
+			size, = ATOM_LARGE_SIZE.unpack(f.read(ATOM_LARGE_SIZE.size))
+			data_offset += ATOM_LARGE_SIZE.size
+		elif size == 0: # goes to the end
+			size = end - offset
+		if size < data_offset - offset or offset + size > end:
+			raise Mp4MetaError(f"Bad size for atom {name!r} at {offset}")
+		yield Mp4Atom(name, offset, data_offset, offset + size)
+		offset += size
+
+# follows the path of atom names down from the top of the file, returning the last one (or None if its not there)
+def find_atom(f: typing.BinaryIO, path: typing.Sequence[bytes]) -> typing.Optional[Mp4Atom]:
+	start, end = 0, None
+	found = None
+	for name in path:
+		found = next((atom for atom in iter_atoms(f, start, end) if atom.name == name), None)
+		if found is None:
+			return None
+		start, end = found.data_offset, found.end
+		if name == b"meta":
+			start += _meta_header_size(f, found)
+	return found
+
+# meta is usually a "full" atom with 4 bytes of version/flags before its children, except for in quicktime files
+def _meta_header_size(f: typing.BinaryIO, meta: Mp4Atom) -> int:
+	f.seek(meta.data_offset)
+	peek = f.read(8)
+	if len(peek) == 8 and peek[4:8] == b"hdlr":
+		return 0
+	return 4
+
+# the value of each data atom in an ilst item. returns (type, payload)
+def _iter_data_atoms(ilst: bytes, start: int, end: int) -> typing.Iterator[typing.Tuple[int, bytes]]:
+	offset = start
+	while offset + ATOM_HEADER.size <= end:
+		size, name = ATOM_HEADER.unpack_from(ilst, offset)
+		if size < ATOM_HEADER.size or offset + size > end:
+			break
+		# data atoms are: header, 1 byte version, 3 bytes type, 4 bytes locale, then the value
+		if name == b"data" and size >= 16:
+			data_type = int.from_bytes(ilst[offset + 9:offset + 12], "big")
+			yield data_type, ilst[offset + 16:offset + size]
+		offset += size
+
+# the items in the contents of an ilst atom, as (name, offset, end)
+def _iter_ilst_items(ilst: bytes) -> typing.Iterator[typing.Tuple[bytes, int, int]]:
+	offset = 0
+	while offset + ATOM_HEADER.size <= len(ilst):
+		size, name = ATOM_HEADER.unpack_from(ilst, offset)
+		if size < ATOM_HEADER.size or offset + size > len(ilst):
+			raise Mp4MetaError(f"Bad size for ilst item {name!r}")
+		yield name, offset, offset + size
+		offset += size
+
+# parses the contents of an ilst atom into {name: [values]}. utf-8 values become strings, and everything else is left as bytes
+def parse_ilst(ilst: bytes) -> typing.Dict[bytes, typing.List[typing.Union[str, bytes]]]:
+	tags = {}
+	for name, start, end in _iter_ilst_items(ilst):
+		values = []
+		for data_type, payload in _iter_data_atoms(ilst, start + ATOM_HEADER.size, end):
+			if data_type == DATA_ATOM_TYPE_UTF8:
+				try:
+					payload = payload.decode("utf-8")
+				except UnicodeDecodeError:
+					pass
+			values.append(payload)
+		tags[name] = values
+	return tags
+
+# returns the file's ilst tags as {name: [values]}, or None if it doesnt have any
+def read_ilst(video_path: str) -> typing.Optional[typing.Dict[bytes, typing.List[typing.Union[str, bytes]]]]:
+	with open(video_path, "rb") as f:
+		ilst = find_atom(f, ILST_PATH)
+		if ilst is None:
+			return None
+		f.seek(ilst.data_offset)
+		return parse_ilst(f.read(ilst.end - ilst.data_offset))
+
+# the tag named for number i, the way moments names the chunks of json it stores (\x00\x00\x00\x01 and so on)
+def numbered_tag_name(i: int) -> bytes:
+	return (i + 1).to_bytes(4, byteorder="big")
+
+# the text of the numbered tags, in order, up until the first one thats missing or isnt text
+def numbered_texts(tags: typing.Dict[bytes, typing.List[typing.Union[str, bytes]]]) -> typing.List[str]:
+	texts = []
+	i = 0
+	while True:
+		values = tags.get(numbered_tag_name(i))
+		if not values or not isinstance(values[0], str):
+			return texts
+		texts.append(values[0])
+		i += 1
+
+# the json steelseries moments stores in a clip, split across the numbered tags, which end with ffmpeg's "Lavf..." tag.
+# returns None if the clip doesnt have any. with just_get_lavf, returns that Lavf tag instead
+def read_video_json(video_path: str, just_get_lavf: bool = False):
+	tags = read_ilst(video_path) or {}
+	jsontext = ""
+	for text in numbered_texts(tags):
+		if text.startswith("Lavf"):
+			if just_get_lavf:
+				return text
+			break
+		jsontext += text
+
+	if just_get_lavf or jsontext == "":
+		return None # EMPTYYYYYY
+
+	jsontext = jsontext.replace("\r", "")
+	return json.loads(jsontext)
+
+
+def _render_atom(name: bytes, payload: bytes) -> bytes:
+	return ATOM_HEADER.pack(ATOM_HEADER.size + len(payload), name) + payload
+
+def _render_text_item(name: bytes, text: str) -> bytes:
+	# version 0, the type, then a locale of 0
+	data = bytes(1) + DATA_ATOM_TYPE_UTF8.to_bytes(3, "big") + bytes(4) + text.encode("utf-8")
+	return _render_atom(name, _render_atom(b"data", data))
+
+# the texts to store in the numbered tags for the json. the existing Lavf tag (if there is one) gets kept at the end
+def _json_chunks(json_data, tags: typing.Dict[bytes, typing.List[typing.Union[str, bytes]]]) -> typing.List[str]:
+	text = json.dumps(json_data)
+	chunks = [text[i:i + JSON_CHUNK_SIZE] for i in range(0, len(text), JSON_CHUNK_SIZE)]
+	lavf = next((text for text in numbered_texts(tags) if text.startswith("Lavf")), None)
+	if lavf is not None:
+		chunks.append(lavf)
+	return chunks
+
+# finds the ilst, and how far it could grow into the free atoms right after it. returns (ilst, end of the space)
+def _find_ilst_space(f: typing.BinaryIO) -> typing.Optional[typing.Tuple[Mp4Atom, int]]:
+	meta = find_atom(f, ILST_PATH[:-1])
+	if meta is None:
+		return None
+	atoms = list(iter_atoms(f, meta.data_offset + _meta_header_size(f, meta), meta.end))
+	for i, atom in enumerate(atoms):
+		if atom.name != b"ilst":
+			continue
+		end = atom.end
+		for following in atoms[i + 1:]:
+			if following.name != b"free":
+				break
+			end = following.end
+		return atom, end
+	return None
+
+# writes the json into the clip's numbered tags, replacing whatever json was there. the other tags are left alone.
+# returns True if it fit in place, or False if the file had to be rewritten (by mutagen, which fixes up the offsets)
+def write_video_json(video_path: str, json_data) -> bool:
+	with open(video_path, "r+b") as f:
+		space = _find_ilst_space(f)
+		if space is not None:
+			ilst, space_end = space
+			f.seek(ilst.data_offset)
+			old_ilst = f.read(ilst.end - ilst.data_offset)
+			chunks = _json_chunks(json_data, parse_ilst(old_ilst))
+			# the other tags get copied over byte for byte, and the numbered ones get replaced
+			items = [old_ilst[start:end] for name, start, end in _iter_ilst_items(old_ilst) if not _is_numbered_tag_name(name)]
+			items.extend(_render_text_item(numbered_tag_name(i), chunk) for i, chunk in enumerate(chunks))
+			new_ilst = _render_atom(b"ilst", b"".join(items))
+			leftover = space_end - ilst.offset - len(new_ilst)
+			# whatever's left over has to be filled with a free atom, which needs at least room for its header
+			if leftover == 0 or leftover >= ATOM_HEADER.size:
+				if leftover > 0:
+					new_ilst += _render_atom(b"free", bytes(leftover - ATOM_HEADER.size))
+				f.seek(ilst.offset)
+				f.write(new_ilst)
+				f.flush()
+				os.fsync(f.fileno())
+				return True
+	_write_video_json_mutagen(video_path, json_data)
+	return False
+
+def _is_numbered_tag_name(name: bytes) -> bool:
+	return name[:3] == bytes(3) and name[3] != 0
+
+def _write_video_json_mutagen(video_path: str, json_data):
+	from mutagen.mp4 import MP4 # only needed when theres no room, so its imported here
+	video = MP4(video_path)
+	if video.tags is None:
+		video.add_tags()
+	chunks = _json_chunks(json_data, read_ilst(video_path) or {})
+	for key in list(video.tags.keys()):
+		if _is_numbered_tag_name(key.encode("latin1")):
+			del video.tags[key]
+	for i, chunk in enumerate(chunks):
+		video.tags[numbered_tag_name(i).decode("latin1")] = chunk
+	video.save()
+
+# writes the json for a bunch of clips at once ({path: json}), spread across threads. if an infocache is given, the
+# clips get invalidated in it, so their info gets reloaded next time its synced. returns the errors for any that failed
+def write_video_jsons(updates: typing.Dict[str, typing.Any], workers: int = None, infocache: typing.Optional['FileInfoCache'] = None) -> typing.Dict[str, str]:
+	failures = {}
+	try:
+		with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kewi-mp4meta") as executor:
+			futures = { executor.submit(write_video_json, path, json_data): path for path, json_data in updates.items() }
+			for future in as_completed(futures):
+				try:
+					future.result()
+				except Exception as e:
+					failures[futures[future]] = f"{type(e).__name__}: {e}"
+	finally:
+		if infocache is not None:
+			infocache.invalidate(updates.keys())
+	return failures
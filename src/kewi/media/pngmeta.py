@@ -0,0 +1,65 @@
+import mmap
+import struct
+import typing
+import zlib
+
+# reads the text chunks (tEXt, zTXt, and iTXt) out of a png, like the prompt/workflow json comfyui saves in its images.
+# the file is memory mapped, and reading stops at the first IDAT, since text chunks that matter come before the image data
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+CHUNK_HEADER = struct.Struct(">I4s") # length, type
+CHUNK_CRC_SIZE = 4
+
+# the text chunks in data (anything bytes-like, like an mmap) as {keyword: text}. returns {} if it isnt a png
+def parse_png_text(data) -> typing.Dict[str, str]:
+	texts = {}
+	if data[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+		return texts
+	view = memoryview(data)
+	try:
+		offset = len(PNG_SIGNATURE)
+		while offset + CHUNK_HEADER.size <= len(view):
+			length, chunk_type = CHUNK_HEADER.unpack_from(view, offset)
+			start = offset + CHUNK_HEADER.size
+			end = start + length
+			if chunk_type in (b"IDAT", b"IEND") or end > len(view):
+				break
+			if chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+				try:
+					keyword, text = _parse_text_chunk(chunk_type, bytes(view[start:end]))
+				except (ValueError, IndexError, zlib.error):
+					pass # a broken text chunk, which we can just skip, same as PIL would
+				else:
+					texts[keyword] = text
+			offset = end + CHUNK_CRC_SIZE
+	finally:
+		view.release() # so an mmap under this can be closed
+	return texts
+
+def _parse_text_chunk(chunk_type: bytes, chunk: bytes) -> typing.Tuple[str, str]:
+	keyword, separator, rest = chunk.partition(b"\0")
+	if not separator:
+		raise ValueError("text chunk has no keyword")
+	keyword = keyword.decode("latin-1")
+	if chunk_type == b"tEXt":
+		return keyword, rest.decode("latin-1")
+	if chunk_type == b"zTXt":
+		# 1 byte compression method (always zlib), then the compressed text
+		return keyword, zlib.decompress(rest[1:]).decode("latin-1")
+	# iTXt: compression flag, compression method, language\0, translated keyword\0, then the utf-8 text
+	compressed = rest[0]
+	_, _, rest = rest[2:].partition(b"\0")
+	_, _, text = rest.partition(b"\0")
+	if compressed:
+		text = zlib.decompress(text)
+	return keyword, text.decode("utf-8")
+
+# the text chunks of the png file as {keyword: text}. returns {} if it isnt a png
+def read_png_text(filename: str) -> typing.Dict[str, str]:
+	with open(filename, "rb") as f:
+		try:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			return {} # empty file
+		with data:
+			return parse_png_text(data)
@@ -1,5 +1,11 @@
 import os
 import datetime
+import threading
+
+if os.name == "nt":
+	import msvcrt
+else:
+	import fcntl
 
 def REPO_PATH(sub_path):
 	# Get the directory where this script (and your library) is located
@@ -15,6 +21,58 @@ def RESOURCE_PATH(sub_path):
 
 
 
+class FileLock():
+	"""
+	An advisory lock on a file, so multiple processes can take turns working on shared files.
+	Re-entrant, and also works as a lock between threads of the same process
+	"""
+	def __init__(self, filename: str):
+		self.filename = filename
+		self._fd = None
+		self._depth = 0
+		self._thread_lock = threading.RLock()
+
+	def acquire(self):
+		self._thread_lock.acquire()
+		if self._depth == 0:
+			fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+			try:
+				if os.name == "nt":
+					while True:
+						try:
+							msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+							break
+						except OSError:
+							continue # LK_LOCK gives up after 10 seconds, but we want to keep waiting
+				else:
+					fcntl.flock(fd, fcntl.LOCK_EX)
+			except:
+				os.close(fd)
+				self._thread_lock.release()
+				raise
+			self._fd = fd
+		self._depth += 1
+
+	def release(self):
+		self._depth -= 1
+		if self._depth == 0:
+			if os.name == "nt":
+				os.lseek(self._fd, 0, os.SEEK_SET)
+				msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+			else:
+				fcntl.flock(self._fd, fcntl.LOCK_UN)
+			os.close(self._fd)
+			self._fd = None
+		self._thread_lock.release()
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.release()
+
+
 class SimpleTimer():
 	def __init__(self, message=None):
 		self.message = message
@@ -1,3 +1,5 @@
+import kewi
+import asyncio
 from aiohttp import web
 from aiohttp.web_request import Request
 from kewi.context import KewiContextWebJson
@@ -9,6 +11,7 @@ from kewi.core.runner import Runner
 class KewiWebBackend():
 	def __init__(self):
 		self.runner = Runner()
+		kewi.cache.start_janitor()
 	
 	async def handle_request(self, request: Request):
 		endpoint = request.match_info.get("endpoint")
@@ -19,6 +22,8 @@ class KewiWebBackend():
 			return await self.handle_info(request, target)
 		elif endpoint == "run":
 			return await self.handle_run(request, target)
+		elif endpoint == "cache":
+			return await self.handle_cache(request)
 		else:
 			return web.Response(text=f"'{endpoint}' is not a valid endpoint!", status=400)
 	
@@ -43,6 +48,11 @@ class KewiWebBackend():
 				result["args"].append(arg.to_json())
 		return web.json_response(result)
 	
+	async def handle_cache(self, request: Request):
+		# stats() can wait on the index lock, so its done off of the event loop
+		stats = await asyncio.get_running_loop().run_in_executor(None, kewi.cache.stats)
+		return web.json_response(stats)
+
 	async def handle_run(self, request: Request, scriptname: str):
 		script_info = self.runner.get_script(scriptname)
 		if script_info is None:
@@ -0,0 +1,86 @@
+# benchmarks how much disk space each compression codec saves for cached json, and how much slower it makes reading it back
+import kewi
+import json
+import random
+import shutil
+import tempfile
+import time
+from kewi.cache import Cache
+from kewi.cache_codecs import CACHE_CODECS
+
+ARG_entries: int = 50
+ARG_reads: int = 5
+kewi.ctx.init()
+
+# makes json shaped like an opendota match, with per-minute arrays for each player, so the size grows with its length
+def make_match(match_id: int, minutes: int):
+	rng = random.Random(match_id)
+	players = []
+	for slot in range(10):
+		gold = 0
+		gold_t = []
+		for _ in range(minutes):
+			gold += rng.randint(200, 800)
+			gold_t.append(gold)
+		players.append({
+			"account_id": rng.randint(1000000, 200000000),
+			"player_slot": slot if slot < 5 else slot + 123,
+			"hero_id": rng.randint(1, 130),
+			"kills": rng.randint(0, 20),
+			"deaths": rng.randint(0, 15),
+			"assists": rng.randint(0, 30),
+			"gold_t": gold_t,
+			"xp_t": [value * 2 for value in gold_t],
+			"lh_t": [i * rng.randint(3, 8) for i in range(minutes)],
+			"purchase_log": [{ "time": rng.randint(0, minutes * 60), "key": rng.choice(["tango", "blink", "bkb", "clarity", "ward_observer"]) } for _ in range(minutes)],
+			"personaname": f"player_{rng.randint(0, 100000)}"
+		})
+	return {
+		"match_id": match_id,
+		"duration": minutes * 60,
+		"radiant_win": rng.random() > 0.5,
+		"players": players,
+		"radiant_gold_adv": [rng.randint(-20000, 20000) for _ in range(minutes)]
+	}
+
+corpora = {
+	"small (5 min)": 5,
+	"match (45 min)": 45,
+	"long (120 min)": 120
+}
+
+def run_benchmark(codec, minutes: int):
+	cache_dir = tempfile.mkdtemp(prefix="kewi_cache_bench_")
+	try:
+		cache = Cache(cache_dir, max_bytes=None)
+		raw_size = 0
+		for i in range(ARG_entries):
+			data = json.dumps(make_match(i, minutes)).encode("utf-8")
+			raw_size += len(data)
+			cache.put(f"bench.match_{i}", data, "json", codec=codec)
+		disk_size = cache.index.total_size()
+
+		start = time.perf_counter()
+		for _ in range(ARG_reads):
+			for i in range(ARG_entries):
+				cache.get(f"bench.match_{i}", "json")
+		read_ms = (time.perf_counter() - start) * 1000 / (ARG_reads * ARG_entries)
+		return raw_size, disk_size, read_ms
+	finally:
+		shutil.rmtree(cache_dir, ignore_errors=True)
+
+codecs = [None] + list(CACHE_CODECS.keys()) + ["auto"]
+kewi.ctx.print(f"Writing {ARG_entries} matches per corpus, reading each back {ARG_reads} times")
+rows = []
+for corpus_name, minutes in corpora.items():
+	for codec in codecs:
+		raw_size, disk_size, read_ms = run_benchmark(codec, minutes)
+		rows.append([
+			corpus_name,
+			codec or "none",
+			f"{raw_size / ARG_entries / 1024:.1f}",
+			f"{disk_size / ARG_entries / 1024:.1f}",
+			f"{raw_size / disk_size:.1f}x",
+			f"{read_ms:.3f}"
+		])
+kewi.ctx.print_table(rows, headers=["Corpus", "Codec", "Raw (KB)", "On Disk (KB)", "Ratio", "Read (ms)"])
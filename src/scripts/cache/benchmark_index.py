@@ -0,0 +1,49 @@
+# benchmarks how fast cache entries can be created, and how long opening the cache takes, as the cache index grows
+import kewi
+import shutil
+import tempfile
+import time
+from kewi.cache import Cache
+from kewi.cache_index import CACHE_INDEX_ENGINES
+
+ARG_entries: int = 50000
+ARG_rounds: int = 10
+kewi.ctx.init()
+
+def run_benchmark(engine: str):
+	cache_dir = tempfile.mkdtemp(prefix="kewi_cache_bench_")
+	try:
+		cache = Cache(cache_dir, engine)
+		per_round = ARG_entries // ARG_rounds
+		results = []
+		for round_index in range(ARG_rounds):
+			start = time.perf_counter()
+			for i in range(per_round):
+				cache.new(f"bench.round_{round_index}.item_{i}", "json")
+			elapsed = time.perf_counter() - start
+			throughput = int(per_round / elapsed)
+
+			# opening the cache and looking up one uri, like a script that does "import kewi" would
+			start = time.perf_counter()
+			Cache(cache_dir, engine).get_filename(f"bench.round_0.item_0")
+			open_ms = (time.perf_counter() - start) * 1000
+			results.append((throughput, open_ms))
+		return results
+	finally:
+		shutil.rmtree(cache_dir, ignore_errors=True)
+
+kewi.ctx.print(f"Creating {ARG_entries} entries in {ARG_rounds} rounds")
+engines = list(CACHE_INDEX_ENGINES.keys())
+results = { engine: run_benchmark(engine) for engine in engines }
+
+headers = ["Index Size"]
+for engine in engines:
+	headers.extend([f"{engine} (entries/s)", f"{engine} open (ms)"])
+rows = []
+for i in range(ARG_rounds):
+	row = [(ARG_entries // ARG_rounds) * (i + 1)]
+	for engine in engines:
+		throughput, open_ms = results[engine][i]
+		row.extend([throughput, f"{open_ms:.2f}"])
+	rows.append(row)
+kewi.ctx.print_table(rows, headers=headers)
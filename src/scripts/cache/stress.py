@@ -0,0 +1,59 @@
+# runs a bunch of processes against the same cache at once, and checks that none of their entries got lost
+import kewi
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from kewi.cache import Cache
+from kewi.utils import REPO_PATH
+from kewi.context import TableAlign
+
+ARG_processes: int = 8
+ARG_entries: int = 500
+kewi.ctx.init()
+
+# each worker creates its own entries, fights over some shared ones, and looks up the entries of the worker next to it
+WORKER_CODE = """
+import sys
+from kewi.cache import Cache
+cache_dir, worker, entries, processes = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+cache = Cache(cache_dir)
+for i in range(entries):
+	filename = cache.new(f"stress.worker_{worker}.item_{i}", "txt")
+	with open(filename, "w+") as f:
+		f.write(str(i))
+	cache.new(f"stress.shared.item_{i % 10}", "txt")
+	cache.get_filename(f"stress.worker_{(worker + 1) % processes}.item_{i}")
+	cache.get_filename(f"stress.shared.item_{i % 10}")
+"""
+
+cache_dir = tempfile.mkdtemp(prefix="kewi_cache_stress_")
+try:
+	env = dict(os.environ)
+	env["PYTHONPATH"] = REPO_PATH("src") + os.pathsep + env.get("PYTHONPATH", "")
+	kewi.ctx.print(f"Running {ARG_processes} processes with {ARG_entries} entries each...")
+	processes = []
+	for worker in range(ARG_processes):
+		args = [sys.executable, "-c", WORKER_CODE, cache_dir, str(worker), str(ARG_entries), str(ARG_processes)]
+		processes.append(subprocess.Popen(args, env=env))
+	return_codes = [process.wait() for process in processes]
+
+	cache = Cache(cache_dir)
+	rows = []
+	for worker in range(ARG_processes):
+		missing = 0
+		for i in range(ARG_entries):
+			if cache.get_filename(f"stress.worker_{worker}.item_{i}") is None:
+				missing += 1
+		rows.append([worker, return_codes[worker], missing])
+	kewi.ctx.print_table(rows, headers=["Worker", "Exit Code", "Missing Entries"], align=TableAlign.RIGHT)
+
+	expected_size = (ARG_processes * ARG_entries) + min(ARG_entries, 10)
+	kewi.ctx.print(f"Index has {cache.size} entries, expected {expected_size}")
+	if cache.size != expected_size or any(row[1] != 0 or row[2] != 0 for row in rows):
+		kewi.ctx.print("FAILED")
+	else:
+		kewi.ctx.print("PASSED")
+finally:
+	shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1,76 @@
+# benchmarks reading the comfyui prompt/workflow out of generated images with kewi.media.pngmeta, compared to PIL
+import kewi
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from kewi.media.pngmeta import read_png_text
+
+ARG_images_dir: str = kewi.globals.ComfyUI.SERVER_OUT_DIR
+ARG_count: int = 3000
+# if this is more than 0, makes this many fake comfyui images to test with instead of using the images dir
+ARG_fake_images: int = 0
+kewi.ctx.init()
+
+# the way the metadata used to get read, before pngmeta
+def pil_read_metadata(filename):
+	img = Image.open(filename)
+	return { key: img.info[key] for key in ("prompt", "workflow") if key in img.info }
+
+def pngmeta_read_metadata(filename):
+	texts = read_png_text(filename)
+	return { key: texts[key] for key in ("prompt", "workflow") if key in texts }
+
+# a workflow with a chain of nodes, about as big as a typical one
+def make_workflow(rng: random.Random):
+	prompt = {}
+	for i in range(40):
+		inputs = { "seed": rng.randint(0, 2 ** 32), "text": "a picture of something " * rng.randint(1, 10) }
+		if i > 0:
+			inputs["model"] = [str(i - 1), 0]
+		prompt[str(i)] = { "class_type": rng.choice(["KSampler", "CLIPTextEncode", "VAEDecode", "LoraLoader"]), "inputs": inputs }
+	workflow = { "nodes": [{ "id": i, "type": node["class_type"], "order": i, "widgets_values": list(node["inputs"].values())[:2] } for i, node in enumerate(prompt.values())] }
+	return prompt, workflow
+
+def make_fake_images(images_dir: str, count: int):
+	rng = random.Random(0)
+	for i in range(count):
+		prompt, workflow = make_workflow(rng)
+		info = PngInfo()
+		info.add_text("prompt", json.dumps(prompt))
+		info.add_text("workflow", json.dumps(workflow))
+		img = Image.frombytes("RGB", (512, 512), rng.randbytes(512 * 512 * 3))
+		img.save(os.path.join(images_dir, f"ComfyUI_{i:05}_.png"), pnginfo=info, compress_level=1)
+
+fake_dir = None
+if ARG_fake_images > 0:
+	fake_dir = tempfile.mkdtemp()
+	make_fake_images(fake_dir, ARG_fake_images)
+	images_dir = fake_dir
+else:
+	images_dir = ARG_images_dir
+
+images = [entry.path for entry in os.scandir(images_dir) if entry.name.endswith(".png") and entry.is_file()][:ARG_count]
+total_mb = sum(map(os.path.getsize, images)) / (1024 * 1024)
+kewi.ctx.print(f"Reading {len(images)} images ({total_mb:.0f} MB total)")
+
+rows = []
+results = {}
+for name, read in { "PIL": pil_read_metadata, "pngmeta": pngmeta_read_metadata }.items():
+	start = time.perf_counter()
+	results[name] = [read(path) for path in images]
+	elapsed_ms = (time.perf_counter() - start) * 1000
+	rows.append([name, f"{elapsed_ms:.1f}", f"{elapsed_ms / max(len(images), 1):.3f}"])
+speedup = float(rows[0][1]) / max(float(rows[1][1]), 0.001)
+rows[0].append("")
+rows[1].append(f"{speedup:.1f}x")
+
+kewi.ctx.print_table(rows, headers=["Reader", "Total (ms)", "Per Image (ms)", "Speedup"])
+kewi.ctx.print(f"Same results: {'yes' if results['PIL'] == results['pngmeta'] else 'NO'}")
+
+if fake_dir is not None:
+	shutil.rmtree(fake_dir)
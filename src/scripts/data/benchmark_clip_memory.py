@@ -0,0 +1,94 @@
+# benchmarks how much memory ClipsDataSource holds onto per clip, compared to keeping a full VideoClip (with its info) for each
+import kewi
+import gc
+import json
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+from dateutil import parser as dateutil_parser
+from kewi.args import LOCAL_TZ
+from kewi.data.intervalindex import IntervalIndex
+from kewi.data.sources.moments_clips import ClipEntry, VideoClip
+
+ARG_clips: int = 20000
+kewi.ctx.init()
+
+rng = random.Random(0)
+year_start = datetime(2024, 1, 1, tzinfo=LOCAL_TZ)
+
+# info shaped like what moments writes into each clip
+def make_info(i: int) -> dict:
+	recording = year_start + timedelta(seconds=rng.uniform(0, 365 * 24 * 60 * 60))
+	clip_start = rng.uniform(0, 3600)
+	return {
+		"name": f"Clip {i}",
+		"recording_timestamp": recording.isoformat(),
+		"clip_start_point": clip_start,
+		"clip_end_point": clip_start + rng.uniform(10, 120),
+		"library_game_unique_id": rng.randint(1, 50),
+		"library_game_name": "Dota 2",
+		"recording_id": f"{rng.getrandbits(64):016x}",
+		"resolution": [1920, 1080],
+		"fps": 60,
+		"tags": ["highlight", "moments"],
+		"description": "",
+		"creation_timestamp": recording.isoformat()
+	}
+
+# what each clip looked like before DataItem and TimeSpan had slots, and when ClipsDataSource kept a VideoClip with its
+# whole info for every clip
+class OldTimeSpan:
+	def __init__(self, start: datetime, end: datetime):
+		self.start = start.astimezone(LOCAL_TZ)
+		self.end = end.astimezone(LOCAL_TZ)
+
+class OldVideoClip:
+	def __init__(self, file_path: str, info: dict):
+		self.info = info
+		date = dateutil_parser.parse(info["recording_timestamp"])
+		self.uri = f"data.clips.{int(date.timestamp() * 1000)}"
+		self.timestamp = OldTimeSpan(date + timedelta(seconds=info["clip_start_point"]), date + timedelta(seconds=info["clip_end_point"]))
+		self.link = file_path
+		self.title = info["name"]
+		self.description = f"{int(info['clip_end_point'] - info['clip_start_point'])} sec clip. Game ID: {info['library_game_unique_id']}"
+
+# the infos come in as json, like they do from the FileInfoCache
+rows = [(f"D:/Moments/clip_{i}.mp4", json.dumps(make_info(i))) for i in range(ARG_clips)]
+
+def build_old():
+	return [OldVideoClip(path, json.loads(text)) for path, text in rows]
+
+# info left out, since it gets loaded from the FileInfoCache when its asked for
+def build_slotted():
+	return [VideoClip(path, None, ClipEntry.from_info(path, json.loads(text))) for path, text in rows]
+
+def build_entries():
+	entries = [ClipEntry.from_info(path, json.loads(text)) for path, text in rows]
+	return IntervalIndex.from_bounds(entries, lambda entry: (entry.start, entry.end))
+
+# how many bytes are still allocated once build() is done and its result is being held onto
+def measure(build) -> int:
+	gc.collect()
+	tracemalloc.start()
+	result = build()
+	gc.collect()
+	size, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del result
+	return size
+
+representations = {
+	"VideoClips with info (before)": build_old,
+	"Slotted VideoClips, info on demand": build_slotted,
+	"ClipEntries + index (now)": build_entries
+}
+before_size = None
+table_rows = []
+for name, build in representations.items():
+	size = measure(build)
+	if before_size is None:
+		before_size = size
+	table_rows.append([name, f"{size / (1024 * 1024):.1f}", f"{size / ARG_clips:.0f}", f"{before_size / size:.1f}x"])
+
+kewi.ctx.print(f"Memory held for {ARG_clips} clips")
+kewi.ctx.print_table(table_rows, headers=["Representation", "Total (MB)", "Bytes / Clip", "Smaller By"])
@@ -0,0 +1,54 @@
+# benchmarks finding the DataItems in a span of time with an IntervalIndex, compared to checking every item
+import kewi
+import random
+import time
+from datetime import datetime, timedelta
+from kewi.args import TimeSpan, LOCAL_TZ
+from kewi.data.datasource import DataItem
+from kewi.data.intervalindex import IntervalIndex
+
+ARG_items: int = 100000
+ARG_queries: int = 200
+kewi.ctx.init()
+
+rng = random.Random(0)
+year_start = datetime(2024, 1, 1, tzinfo=LOCAL_TZ)
+year_seconds = 365 * 24 * 60 * 60
+
+# mostly short clip-like items, with the occasional long one (like a whole play session)
+def make_item(i: int) -> DataItem:
+	start = year_start + timedelta(seconds=rng.uniform(0, year_seconds))
+	if rng.random() < 0.01:
+		length = timedelta(hours=rng.uniform(1, 12))
+	else:
+		length = timedelta(seconds=rng.uniform(10, 600))
+	return DataItem(f"bench.item_{i}", TimeSpan(start, start + length))
+
+def make_query(length: timedelta) -> TimeSpan:
+	start = year_start + timedelta(seconds=rng.uniform(0, year_seconds))
+	return TimeSpan(start, start + length)
+
+items = [make_item(i) for i in range(ARG_items)]
+
+start = time.perf_counter()
+index = IntervalIndex(items)
+build_ms = (time.perf_counter() - start) * 1000
+kewi.ctx.print(f"Built an index of {ARG_items} items in {build_ms:.1f} ms")
+
+rows = []
+for query_name, length in { "1 hour": timedelta(hours=1), "1 day": timedelta(days=1), "1 week": timedelta(weeks=1) }.items():
+	queries = [make_query(length) for _ in range(ARG_queries)]
+
+	start = time.perf_counter()
+	linear_results = [list(filter(lambda item: query.intersects(item.timestamp), items)) for query in queries]
+	linear_ms = (time.perf_counter() - start) * 1000 / ARG_queries
+
+	start = time.perf_counter()
+	index_results = [[item for item in index.query(query) if query.intersects(item.timestamp)] for query in queries]
+	index_ms = (time.perf_counter() - start) * 1000 / ARG_queries
+
+	matches = all(set(map(id, a)) == set(map(id, b)) for a, b in zip(linear_results, index_results))
+	average_results = sum(map(len, index_results)) / ARG_queries
+	rows.append([query_name, f"{average_results:.1f}", f"{linear_ms:.3f}", f"{index_ms:.3f}", f"{linear_ms / index_ms:.0f}x", "yes" if matches else "NO"])
+
+kewi.ctx.print_table(rows, headers=["Query", "Avg Results", "Linear (ms)", "Index (ms)", "Speedup", "Same Results"])
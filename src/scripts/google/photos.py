@@ -90,16 +90,21 @@ def get_photos_by_timespan(service, timespan: kewi.args.TimeSpan):
 		print(f'No photos found for:\n{timespan}.')
 	else:
 		print(f'Photos found for:\n{timespan}:')
-		for item in items:
-			print(f"- {item['filename']}: [{item['mediaMetadata']['creationTime']}] {item['productUrl']}")
-			# Extract file name and extension
-			file_name = item['filename']
-			name, ext = os.path.splitext(file_name)
-
-			# Get image URL and the file path where to save
-			download_url = item['baseUrl'] + "=d"  # Adding '=d' to get the original quality
-			save_path = kewi.cache.new(f"google_photos.{name}", ext.lstrip('.'))  # Call the cache function
-
+		# the cache entries are all made in one index write, and then downloaded after, so the lock isnt held while downloading
+		downloads = []
+		with kewi.cache.batch():
+			for item in items:
+				print(f"- {item['filename']}: [{item['mediaMetadata']['creationTime']}] {item['productUrl']}")
+				# Extract file name and extension
+				file_name = item['filename']
+				name, ext = os.path.splitext(file_name)
+
+				# Get image URL and the file path where to save
+				download_url = item['baseUrl'] + "=d"  # Adding '=d' to get the original quality
+				save_path = kewi.cache.new(f"google_photos.{name}", ext.lstrip('.'))  # Call the cache function
+				downloads.append((download_url, save_path))
+
+		for download_url, save_path in downloads:
 			if not os.path.exists(save_path):
 				download_image(download_url, save_path)
 	return items
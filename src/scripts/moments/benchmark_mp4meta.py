@@ -0,0 +1,95 @@
+# benchmarks reading the json out of moments clips with kewi.media.mp4meta, compared to loading them with mutagen
+import kewi
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from mutagen.mp4 import MP4
+from kewi.media.mp4meta import read_video_json, numbered_tag_name
+
+ARG_clips_dir: str = kewi.globals.Moments.ROOT_DIR
+ARG_count: int = 20
+ARG_repeats: int = 3
+# if this is more than 0, makes (sparse) fake clips of this many GB to test with instead of using the clips dir
+ARG_fake_clip_gb: int = 0
+kewi.ctx.init()
+
+# the way clips used to get read, before mp4meta
+def mutagen_read_video_json(video_path):
+	video = MP4(video_path)
+	jsontext = ""
+	for key in video.tags:
+		value = video.tags[key]
+		value_shortened = str(value)
+		if len(value_shortened) > 50:
+			value_shortened = value_shortened[:50 - 3] + "..."
+	i = 0
+	while True:
+		key = numbered_tag_name(i).decode("latin1")
+		if key not in video.tags:
+			break
+		value = video.tags[key]
+		if isinstance(value, list):
+			value = value[0]
+		if value.startswith("Lavf"):
+			break
+		jsontext += value
+		i += 1
+	if jsontext == "":
+		return None
+	return json.loads(jsontext.replace("\r", ""))
+
+def atom(name: bytes, payload: bytes) -> bytes:
+	return struct.pack(">I", 8 + len(payload)) + name + payload
+
+# an mp4 with a huge (sparse) mdat before the moov, which is where it ends up when a recording gets written out
+def make_fake_clip(path: str, size: int, i: int):
+	mvhd = atom(b"mvhd", bytes(4) + struct.pack(">IIII", 0, 0, 1000, 30000) + bytes(80))
+	hdlr = atom(b"hdlr", bytes(8) + b"mdirappl" + bytes(9))
+	moov = atom(b"moov", mvhd + atom(b"udta", atom(b"meta", bytes(4) + hdlr + atom(b"ilst", b""))))
+	with open(path, "wb") as f:
+		f.write(atom(b"ftyp", b"isom\0\0\2\0isomiso2mp41"))
+		f.write(struct.pack(">I4sQ", 1, b"mdat", size + 16))
+		f.seek(size, os.SEEK_CUR) # leaves a hole, so this doesnt actually take up the space
+		f.write(moov)
+	video = MP4(path)
+	text = json.dumps({ "name": f"Clip {i}", "recording_timestamp": "2024-05-01T20:00:00Z", "clip_start_point": 10, "clip_end_point": 40, "library_game_unique_id": i, "padding": "x" * 2000 })
+	chunks = [text[i:i + 255] for i in range(0, len(text), 255)] + ["Lavf60.3.100"]
+	for j, chunk in enumerate(chunks):
+		video[numbered_tag_name(j).decode("latin1")] = chunk
+	video.save()
+
+fake_dir = None
+if ARG_fake_clip_gb > 0:
+	fake_dir = tempfile.mkdtemp()
+	for i in range(ARG_count):
+		make_fake_clip(os.path.join(fake_dir, f"clip_{i}.mp4"), ARG_fake_clip_gb * 1024 * 1024 * 1024, i)
+	clips_dir = fake_dir
+else:
+	clips_dir = ARG_clips_dir
+
+# the biggest clips, since those are the ones where reading more than needed hurts the most
+clips = [entry.path for entry in os.scandir(clips_dir) if entry.name.endswith(".mp4") and entry.is_file()]
+clips = sorted(clips, key=os.path.getsize, reverse=True)[:ARG_count]
+total_gb = sum(map(os.path.getsize, clips)) / (1024 * 1024 * 1024)
+kewi.ctx.print(f"Reading {len(clips)} clips ({total_gb:.1f} GB total), {ARG_repeats} times each")
+
+rows = []
+results = {}
+for name, read in { "mutagen": mutagen_read_video_json, "mp4meta": read_video_json }.items():
+	start = time.perf_counter()
+	for _ in range(ARG_repeats):
+		results[name] = [read(path) for path in clips]
+	elapsed_ms = (time.perf_counter() - start) * 1000 / ARG_repeats
+	rows.append([name, f"{elapsed_ms:.1f}", f"{elapsed_ms / max(len(clips), 1):.3f}"])
+speedup = float(rows[0][1]) / max(float(rows[1][1]), 0.001)
+rows[1].append(f"{speedup:.1f}x")
+rows[0].append("")
+
+kewi.ctx.print_table(rows, headers=["Reader", "Total (ms)", "Per Clip (ms)", "Speedup"])
+kewi.ctx.print(f"Same results: {'yes' if results['mutagen'] == results['mp4meta'] else 'NO'}")
+
+if fake_dir is not None:
+	shutil.rmtree(fake_dir)
@@ -1,7 +1,7 @@
-from mutagen.mp4 import MP4, MP4FreeForm
 import json
 import os
 import kewi
+from kewi.media.mp4meta import read_ilst, read_video_json
 
 # give this a path to a steelseries moments video file
 ARG_video_file: kewi.args.FilePath = kewi.globals.Moments.EXAMPLE_FILE
@@ -12,46 +12,11 @@ kewi.ctx.print("Target File: " + ARG_video_file.fullpath)
 json_filename = kewi.cache.new(ARG_video_file.fullpath, "json")
 # os.startfile(json_filename)
 
-def unicode_key(n):
-	return (n + 1).to_bytes(4, byteorder='big').decode('latin1')
-
-def read_video_json(video_path, just_get_lavf = False):
-	video = MP4(video_path)
-	jsontext = ""
-
-	print("METADATA:")
-	for key in video.tags:
-		value = video.tags[key]
-		escaped_key = ''.join(f'\\x{ord(c):02x}' for c in key)
-		value_shortened = str(value)
-		# if len(value_shortened) > 50:
-		# 	value_shortened = value_shortened[:50 - 3] + "..."
-		print(escaped_key, type(value), value_shortened)
-
-	print("")
-	i = 0
-	while True:
-		key = unicode_key(i)
-		if key not in video.tags:
-			break
-		value = video.tags[key]
-		if isinstance(value, list):
-			value = value[0]
-		if value.startswith("Lavf"):
-			if just_get_lavf:
-				return value
-			break
-		
-		jsontext += value
-		i += 1
-	
-	jsontext = jsontext.replace("\r", "")
-
-	# temp = kewi.cache.temp("json")
-	# with open(temp, "w+") as f:
-	# 	f.write(jsontext)
-	# os.startfile(temp)
-	return json.loads(jsontext)
+print("METADATA:")
+for key, value in (read_ilst(ARG_video_file.fullpath) or {}).items():
+	escaped_key = ''.join(f'\\x{c:02x}' for c in key)
+	print(escaped_key, type(value), str(value))
+print("")
 
 data = read_video_json(ARG_video_file.fullpath)
 
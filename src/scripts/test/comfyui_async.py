@@ -0,0 +1,95 @@
+# runs a batch of workflows through ComfyUiAsyncApi against a fake local comfyui server, and checks each prompt got its own results
+import kewi
+import asyncio
+import random
+import uuid
+from aiohttp import web
+from kewi.comfyui import ComfyUiAsyncApi, ComfyUiWorkflow
+
+ARG_prompts: int = 12
+ARG_max_in_flight: int = 3
+kewi.ctx.init()
+
+# pretends to be comfyui: queues prompts over http, and reports on them over the websocket of the client that queued them.
+# prompts run at the same time with random delays, so their messages get interleaved, and some messages get sent before
+# the /prompt response, like they can with the real thing
+class StubComfyUiServer:
+	def __init__(self):
+		self.sockets = {}
+		self.running = 0
+		self.max_running = 0
+		self.tasks = []
+		self.app = web.Application()
+		self.app.router.add_get("/ws", self.handle_ws)
+		self.app.router.add_post("/prompt", self.handle_prompt)
+
+	async def handle_ws(self, request: web.Request):
+		ws = web.WebSocketResponse()
+		await ws.prepare(request)
+		self.sockets[request.rel_url.query["clientId"]] = ws
+		await ws.send_json({ "type": "status", "data": { "status": { "exec_info": { "queue_remaining": 0 } } } })
+		async for _ in ws:
+			pass
+		return ws
+
+	async def handle_prompt(self, request: web.Request):
+		body = await request.json()
+		prompt_id = str(uuid.uuid4())
+		ws = self.sockets[body["client_id"]]
+		self.running += 1
+		self.max_running = max(self.max_running, self.running)
+		await ws.send_json({ "type": "execution_start", "data": { "prompt_id": prompt_id } })
+		self.tasks.append(asyncio.create_task(self.run_prompt(ws, prompt_id, body["prompt"])))
+		return web.json_response({ "prompt_id": prompt_id, "number": len(self.tasks), "node_errors": {} })
+
+	async def run_prompt(self, ws: web.WebSocketResponse, prompt_id: str, prompt: dict):
+		seed = prompt["1"]["inputs"]["seed"]
+		for value in range(1, 4):
+			await asyncio.sleep(random.uniform(0.01, 0.05))
+			await ws.send_json({ "type": "progress", "data": { "value": value, "max": 3, "prompt_id": prompt_id, "node": "1" } })
+		if seed < 0:
+			await ws.send_json({ "type": "execution_error", "data": { "prompt_id": prompt_id, "node_id": "1", "node_type": "KSampler", "exception_type": "ValueError", "exception_message": f"bad seed {seed}" } })
+		else:
+			image = { "filename": f"out_{seed}.png", "subfolder": "", "type": "output" }
+			await ws.send_json({ "type": "executed", "data": { "node": "2", "output": { "images": [image] }, "prompt_id": prompt_id } })
+			await ws.send_json({ "type": "executing", "data": { "node": None, "prompt_id": prompt_id } })
+		self.running -= 1
+
+def make_workflow(seed: int) -> ComfyUiWorkflow:
+	return ComfyUiWorkflow({
+		"1": { "class_type": "KSampler", "inputs": { "seed": seed } },
+		"2": { "class_type": "PreviewImage", "inputs": { "images": ["1", 0] }, "_meta": { "title": "OUTPUT" } }
+	}, cleanup=False)
+
+async def main():
+	server = StubComfyUiServer()
+	runner = web.AppRunner(server.app)
+	await runner.setup()
+	site = web.TCPSite(runner, "127.0.0.1", 0)
+	await site.start()
+	port = site._server.sockets[0].getsockname()[1]
+
+	seeds = list(range(ARG_prompts))
+	seeds[-1] = -1 # one that errors
+	try:
+		async with ComfyUiAsyncApi(f"127.0.0.1:{port}", max_in_flight=ARG_max_in_flight) as api:
+			results = await api.run_workflows([make_workflow(seed) for seed in seeds])
+	finally:
+		await runner.cleanup()
+
+	failures = []
+	for seed, result in zip(seeds, results):
+		if seed < 0:
+			if result.error is None or f"bad seed {seed}" not in result.error:
+				failures.append(f"seed {seed}: expected an error, got {result.output_image}")
+		elif result.error is not None or not result.output_image.endswith(f"out_{seed}.png"):
+			failures.append(f"seed {seed}: got {result.output_image} / {result.error}")
+	if server.max_running > ARG_max_in_flight:
+		failures.append(f"{server.max_running} prompts ran at once, with a limit of {ARG_max_in_flight}")
+
+	kewi.ctx.print(f"Ran {len(results)} prompts, with at most {server.max_running} at once")
+	for failure in failures:
+		kewi.ctx.print(f"FAILED: {failure}")
+	kewi.ctx.print("All prompts got their own results" if not failures else f"{len(failures)} failures")
+
+asyncio.run(main())